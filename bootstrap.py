@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from calibration import Calib
+
+# Bootstrap uncertainty of the inverse tables.
+#
+# Each replicate resamples, with replacement, the raw readings taken at
+# every measured count and at the relay point, all at once.  A point
+# moves from its mean in the file by as much as its resampled mean
+# moves from the mean of its readings.  Points without raw readings
+# (older .dat loads) are drawn from a normal distribution with their
+# mean and standard error instead.
+#
+# The table's registers are what gets loaded into the module, so they
+# are held fixed: an entry set to base count c with k registers bumped
+# by one count has, in each replicate, ract = ohms[c] +- k*DELTA as in
+# Calib.invert, and rerr its distance from rnom, signed like the table
+# by the side of rnom its base count is on (+ for LO).  This gives
+# confidence intervals for ract and rerr of every entry.  The inversion of Calib.invert is also
+# redone on every replicate, for all nominal resistances together as
+# array operations, to give the fraction of replicates that would have
+# chosen the same registers.
+
+DELTA = 0.25      # as in Calib.invert
+RNOMS = np.arange(1, 300)
+BLOCK = 250       # replicates per batch, bounds the memory used
+
+def curve_points( calib ):
+  # the measured counts in order, then the relay point
+  return calib.measured() + [ calib.samples[-1] ]
+
+def resample( points, nreps, rng ):
+  """Returns (nreps, npoints) bootstrapped mean resistances"""
+  means = np.empty((nreps, len(points)))
+  for i, s in enumerate(points):
+    data = np.asarray(s.samples, dtype=float)
+    if len(data) > 1:
+      # about the mean the file keeps (to 0.01 ohm), which is what
+      # Calib.invert chose the registers from
+      idx = rng.integers(0, len(data), size=(nreps, len(data)))
+      means[:, i] = s.ohms + data[idx].mean(axis=1) - data.mean()
+    else:
+      # a single reading has no stdev, it is taken as it is
+      sem = s.stdev / np.sqrt(s.nsamples) if s.nsamples > 1 else 0.0
+      means[:, i] = rng.normal(s.ohms, sem, size=nreps)
+  return means
+
+def invert_batch( curves, counts ):
+  """
+  Calib.invert for many curves at once.  curves is (nreps, npoints),
+  the measured counts then the relay point, counts the measured counts.
+  Returns, each (nreps, 299) for rnom 1..299: found, base counts,
+  signed register bumps, ract, rerr.
+  """
+  ohms = curves[:, :-1]
+  lo = ohms[:, :-1, None]               # (nreps, npoints-2, 1)
+  hi = ohms[:, 1:, None]
+  crossing = (RNOMS > lo) & (RNOMS <= hi)   # (nreps, npoints-2, 299)
+  found = crossing.any(axis=1)
+  ilo = crossing.argmax(axis=1)         # first crossing, as in the loop
+  rlo = np.take_along_axis(ohms, ilo, axis=1)
+  rhi = np.take_along_axis(ohms, ilo+1, axis=1)
+  # no bumps across a count that was not measured
+  nextto = (np.diff(counts) == 1)[ilo]
+  adjust = np.arange(4)[:, None, None]
+  allowed = (adjust == 0) | nextto
+  errlo = np.where(allowed, np.abs(RNOMS - (rlo + adjust*DELTA)), np.inf)
+  errhi = np.where(allowed, np.abs(RNOMS - (rhi - adjust*DELTA)), np.inf)
+  klo = errlo.argmin(axis=0)            # (nreps, 299)
+  khi = errhi.argmin(axis=0)
+  eminlo = errlo.min(axis=0)
+  eminhi = errhi.min(axis=0)
+  uselo = eminlo < eminhi
+  base = counts[np.where(uselo, ilo, ilo+1)]
+  bumps = np.where(uselo, klo, -khi)
+  ract = np.where(uselo, rlo + klo*DELTA, rhi - khi*DELTA)
+  rerr = np.where(uselo, eminlo, -eminhi)
+  return found, base, bumps, ract, rerr
+
+def bootstrap( calib, nreps=2000, conf=0.95, seed=None ):
+  """
+  Returns a list of rows (reg, ract_lo, ract_hi, rerr_lo, rerr_hi,
+  same) for the entries of calib's inverse table
+  """
+  rng = np.random.default_rng(seed)
+  points = curve_points(calib)
+  counts = np.array([ s.counts for s in points[:-1] ])
+  nominal = np.array([[ s.ohms for s in points ]])
+  _, nbase, nbumps, _, _ = invert_batch(nominal, counts)
+
+  # the table's registers, as a column of the curve and signed bumps
+  entries = [ reg for reg in calib.inverse.regs if reg.rnom != 0 ]
+  rnoms = np.array([ reg.rnom for reg in entries ], dtype=float)
+  base = np.array([ reg.regs[3] for reg in entries ], dtype=int)
+  bumps = np.array([ sum(reg.regs) for reg in entries ]) - 4*base
+  cols = np.searchsorted(counts, base)
+  sign = np.where(nominal[0, cols] < rnoms, 1.0, -1.0)
+  irnom = rnoms.astype(int) - 1
+
+  ract, rerr, same, relay = [], [], [], []
+  for beg in range(0, nreps, BLOCK):
+    curves = resample(points, min(BLOCK, nreps-beg), rng)
+    a = curves[:, cols] + bumps*DELTA
+    ract.append(a)
+    rerr.append(rnoms - a)
+    found, b, k, _, _ = invert_batch(curves, counts)
+    same.append((found & (b == nbase) & (k == nbumps))[:, irnom])
+    relay.append(curves[:, -1])
+  q = [ 50*(1-conf), 50*(1+conf) ]
+  ract_ci = np.percentile(np.concatenate(ract), q, axis=0)
+  # the table's rerr is |rnom - ract| signed by the side, an interval
+  # of rnom - ract that straddles zero folds to [0, the larger end]
+  elo, ehi = np.percentile(np.concatenate(rerr), q, axis=0)
+  maglo = np.where(elo*ehi <= 0, 0.0, np.minimum(abs(elo), abs(ehi)))
+  maghi = np.maximum(abs(elo), abs(ehi))
+  rerr_ci = np.where(sign > 0, [maglo, maghi], [-maghi, -maglo])
+  same = np.concatenate(same).mean(axis=0)
+  relay_ci = np.percentile(np.concatenate(relay), q)
+
+  rows = []
+  i = 0
+  for reg in calib.inverse.regs:
+    if reg.rnom == 0:
+      rows.append((reg, relay_ci[0], relay_ci[1], relay_ci[0], relay_ci[1], 1.0))
+    else:
+      rows.append((reg, ract_ci[0][i], ract_ci[1][i],
+                   rerr_ci[0][i], rerr_ci[1][i], same[i]))
+      i += 1
+  return rows
+
+def print_rows( calib, rows, conf, fp=sys.stdout ):
+  calib.inverse.print_header(fp)
+  print(f'# Rnominal, Registers[1-4], Ractual, Rerror, '
+        f'Ractual and Rerror {100*conf:.0f}% intervals, '
+        f'fraction of replicates choosing these registers', file=fp)
+  for reg, alo, ahi, elo, ehi, same in rows:
+    print(reg, f'{alo:.3f}', f'{ahi:.3f}', f'{elo:+.3f}', f'{ehi:+.3f}',
+          f'{same:.3f}', sep='\t', file=fp)
+
+def process( fname, nreps, conf, seed ):
+  calib = Calib( fname, raw=True )
+  calib.linear_fit()
+  calib.invert()
+  rows = bootstrap( calib, nreps, conf, seed )
+  # next to the input, like the watch builder's outputs
+  fout = os.path.join( os.path.dirname(fname),
+             f'uncert-{calib.serno.lower()}-{calib.resno.lower()}-cal.dat' )
+  with open(fout, 'w') as fp:
+    print_rows( calib, rows, conf, fp )
+  return fout
+
+def main(argv):
+  descr = 'Bootstrap confidence intervals for TraceR inverse tables'
+  parser = argparse.ArgumentParser(description=descr)
+  parser.add_argument('--reps', type=int, default=2000, help='Bootstrap replicates')
+  parser.add_argument('--conf', type=float, default=0.95, help='Confidence level')
+  parser.add_argument('--seed', type=int, default=None, help='Random seed')
+  parser.add_argument('--workers', type=int, default=None, help='Processes, default one per CPU')
+  parser.add_argument('calfiles', nargs='+', help='Cal data file(s) with raw readings')
+  args = parser.parse_args(argv[1:])
+
+  # the modules are independent, one process each
+  with ProcessPoolExecutor(max_workers=args.workers) as pool:
+    jobs = [ pool.submit(process, f, args.reps, args.conf, args.seed)
+             for f in args.calfiles ]
+    for job in jobs:
+      print('Writing uncertainty filename:', job.result())
+
+if __name__ == "__main__":
+  main(sys.argv)
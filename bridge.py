@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import random
+import asyncio
+import re
+import argparse
+from collections import deque, OrderedDict
+
+# GPIB-over-TCP bridge server, the other end of keithley.Remote_device
+#
+# Each request is one message from the client, and gets one reply:
+#   R         read from the instrument       -> 'R:' + reading
+#   W<cmd>    write cmd to the instrument     -> 'W:' + bytes written
+#   Q<cmd>    write cmd then read             -> 'Q:' + reading
+#   C         device clear                    -> 'C:' + 'DCL'
+#   A<addr>   select GPIB address for this
+#             connection (default --address)  -> 'A:' + address
+#   S         latency counters                -> 'S:' + stats table
+# Errors from the instrument reply 'E:' + message + CR LF.  The reply
+# header is always two characters, Remote_device strips it off.  R and
+# Q replies end in the instrument's CR LF, and the client reads to it.
+#
+# All clients share one bus.  Requests are queued per client and the
+# bus worker takes one from each client in turn, so a client looping
+# on queries cannot starve the others.
+
+class Visa_backend:
+  """Instruments on a local GPIB board, through pyvisa"""
+
+  def __init__(self, board=0):
+    import pyvisa
+    self.board = board
+    self.rm = pyvisa.ResourceManager()
+    self.instruments = {}
+
+  def open(self, addr):
+    if addr not in self.instruments:
+      inst = self.rm.open_resource(f'GPIB{self.board}::{addr}::INSTR')
+      inst.timeout = 6000
+      self.instruments[addr] = inst
+    return self.instruments[addr]
+
+  def read(self, addr):
+    return self.open(addr).read()
+
+  def write(self, addr, command):
+    return self.open(addr).write(command)
+
+  def query(self, addr, command):
+    return self.open(addr).query(command)
+
+  def clear(self, addr):
+    self.open(addr).clear()
+    return 'DCL'
+
+class Sim_backend:
+  """Simulated K195A meters, one per address, reading about `ohms`"""
+
+  status_word = '195 6060002000100402=:\r\n'
+  # status word positions of the settings, after '195 '
+  fields = { 'T': (0,1), 'F': (1,2), 'R': (2,3), 'K': (3,4), 'Q': (4,6),
+             'S': (6,7), 'M': (7,8), 'Z': (8,9), 'W': (9,11), 'A': (11,12),
+             'J': (12,13), 'G': (13,14), 'B': (14,15), 'P': (15,16) }
+
+  def __init__(self, ohms=12.0, noise=0.01, delay=0.020):
+    self.ohms = ohms
+    self.noise = noise
+    self.delay = delay   # seconds per bus transaction
+    self.from_store = {}
+    self.status = {}
+
+  def reading(self):
+    value = self.ohms + random.gauss(0.0, self.noise)
+    return f'NOHM+{value/1000:.5f}E+3'
+
+  def read(self, addr):
+    time.sleep(self.delay)
+    if self.from_store.get(addr, False):
+      return ','.join(self.reading() for _ in range(20)) + '\r\n'
+    return self.reading() + '\r\n'
+
+  def write(self, addr, command):
+    time.sleep(self.delay)
+    if 'B1' in command: self.from_store[addr] = True
+    if 'B0' in command: self.from_store[addr] = False
+    sw = self.status.get(addr, self.status_word)
+    for letter, value in re.findall(r'([A-Z])([0-9]+)', command):
+      if letter in self.fields:
+        beg, end = self.fields[letter]
+        value = value.zfill(end-beg)[-(end-beg):]
+        sw = sw[:4+beg] + value + sw[4+end:]
+    self.status[addr] = sw
+    return len(command)
+
+  def query(self, addr, command):
+    if command == 'U0DX':
+      time.sleep(self.delay)
+      return self.status.get(addr, self.status_word)
+    if command:
+      self.write(addr, command)
+    return self.read(addr)
+
+  def clear(self, addr):
+    time.sleep(self.delay)
+    self.from_store[addr] = False
+    self.status.pop(addr, None)
+    return 'DCL'
+
+class Latency:
+  """Running request counters for one operation"""
+
+  def __init__(self):
+    self.count = 0
+    self.errors = 0
+    self.wait = 0.0       # total seconds queued
+    self.service = 0.0    # total seconds on the bus
+    self.worst = 0.0      # longest wait + service
+
+  def add(self, wait, service, ok=True):
+    self.count += 1
+    if not ok: self.errors += 1
+    self.wait += wait
+    self.service += service
+    self.worst = max(self.worst, wait+service)
+
+  def __str__(self):
+    n = max(self.count, 1)
+    return f'{self.count}\t{self.errors}\t'\
+           f'{1000*self.wait/n:.2f}\t{1000*self.service/n:.2f}\t'\
+           f'{1000*self.worst:.2f}'
+
+class Bridge:
+
+  OPS = { 'R': 'read', 'W': 'write', 'Q': 'query', 'C': 'clear' }
+
+  def __init__(self, backend, address=5, verbose=False):
+    self.backend = backend
+    self.address = address
+    self.verbose = verbose
+    self.queues = OrderedDict()   # client -> deque of pending requests
+    self.pending = None
+    self.latency = { op: Latency() for op in Bridge.OPS }
+
+  def print_stats(self, fp=sys.stdout):
+    print('# op\tcount\terrors\twait,ms\tbus,ms\tworst,ms', file=fp)
+    for op, lat in self.latency.items():
+      print(f'{op}\t{lat}', file=fp)
+
+  def stats_text(self):
+    lines = [f'{op}\t{lat}' for op, lat in self.latency.items()]
+    return '\n'.join(lines) + '\n'
+
+  async def handle_client(self, reader, writer):
+    client = writer.get_extra_info('peername')
+    if self.verbose: print('connect:', client)
+    loop = asyncio.get_running_loop()
+    queue = deque()
+    self.queues[client] = queue
+    addr = self.address
+    try:
+      while True:
+        data = await reader.read(1024)
+        if not data: break
+        message = str(data, 'ascii')
+        op, arg = message[0], message[1:]
+        if op == 'A':
+          try:
+            addr = int(arg)
+          except ValueError:
+            pass
+          reply = f'A:{addr}'
+        elif op == 'S':
+          reply = 'S:' + self.stats_text()
+        elif op in Bridge.OPS:
+          done = loop.create_future()
+          queue.append((addr, op, arg, done, time.perf_counter()))
+          self.pending.set()
+          reply = await done
+        else:
+          reply = f'E:unknown request {op}'
+        writer.write(reply.encode('ascii'))
+        await writer.drain()
+    except ConnectionError as e:
+      if self.verbose: print(client, e)
+    finally:
+      del self.queues[client]
+      for _, _, _, done, _ in queue:
+        done.cancel()
+      writer.close()
+      if self.verbose: print('disconnect:', client)
+
+  def execute(self, addr, op, arg):
+    if op == 'R':
+      return 'R:' + self.backend.read(addr)
+    elif op == 'W':
+      return 'W:' + str(self.backend.write(addr, arg))
+    elif op == 'Q':
+      return 'Q:' + self.backend.query(addr, arg)
+    else:
+      return 'C:' + self.backend.clear(addr)
+
+  async def bus_worker(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      await self.pending.wait()
+      served = False
+      # one request from each client with work, in turn
+      for client in list(self.queues):
+        queue = self.queues.get(client)
+        if not queue: continue
+        addr, op, arg, done, queued = queue.popleft()
+        start = time.perf_counter()
+        ok = True
+        try:
+          # the backend blocks, keep it off the event loop
+          reply = await loop.run_in_executor(None, self.execute, addr, op, arg)
+        except Exception as e:
+          ok = False
+          # terminated like instrument replies, the client reads to it
+          reply = f'E:{e}\r\n'
+        finish = time.perf_counter()
+        self.latency[op].add(start-queued, finish-start, ok)
+        if not done.done(): done.set_result(reply)
+        served = True
+      if not served:
+        self.pending.clear()
+
+  async def serve(self, host, port):
+    self.pending = asyncio.Event()
+    server = await asyncio.start_server(self.handle_client, host, port)
+    worker = asyncio.create_task(self.bus_worker())
+    print(f'GPIB bridge listening on {host}:{port}')
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      worker.cancel()
+
+def main(argv):
+  descr = 'GPIB-over-TCP bridge server for keithley.Remote_device'
+  parser = argparse.ArgumentParser(description=descr)
+  parser.add_argument('--host', default='0.0.0.0', help='Interface to listen on')
+  parser.add_argument('--port', type=int, default=65432, help='TCP port to listen on')
+  parser.add_argument('--board', type=int, default=0, help='GPIB board number')
+  parser.add_argument('--address', type=int, default=5, help='Default GPIB address')
+  parser.add_argument('--sim', action='store_true', help='Use simulated meters instead of pyvisa')
+  parser.add_argument('--verbose', action='store_true', help='Print client connections')
+  args = parser.parse_args(argv[1:])
+
+  if args.sim:
+    backend = Sim_backend()
+  else:
+    backend = Visa_backend(args.board)
+  bridge = Bridge(backend, args.address, args.verbose)
+  try:
+    asyncio.run(bridge.serve(args.host, args.port))
+  except KeyboardInterrupt:
+    pass
+  bridge.print_stats()
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -1,114 +1,147 @@
 #!/usr/bin/env python3
 
 from tracer import Tracer
+from calibration import Sample
+from writer import Result_writer
+from profiling import Profiler
+import tracer
 import keithley
 import time
 import datetime as dt
 import sys
-import statistics as stats
-
-def main():
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger('cal')
+
+def main(argv):
+
+  # silent by default, -v for progress, -vv for every reading
+  level = logging.WARNING
+  if '-v' in argv: level = logging.INFO
+  if '-vv' in argv: level = logging.DEBUG
+  logging.basicConfig(level=level, format='%(message)s')
+
+  # --profile: time serial, GPIB, settling sleeps and file I/O
+  prof = Profiler('cal', '--profile' in argv)
+  prof.wrap(time, ['sleep'], 'settle')
+  prof.wrap(tracer, ['sleep'], 'settle')
+  prof.start()
+
+  # which resistor(s) to calibrate, '12' sweeps both concurrently,
+  # each on its own meter
+  argv = [ a for a in argv if a not in ('--profile', '-v', '-vv') ]
+  which = argv[1] if len(argv) > 1 else '1'
+  if which not in ('1', '2', '12'):
+    print('Usage: cal [1|2|12] [--profile] [-v|-vv]   for R1, R2 or both')
+    exit(0)
+  dual = which == '12'
 
   init_comms = True
+  bulk = False # data store fetch, not yet tried on a real meter
   print('=== Initializing TraceR Module ===')
   Tracer.init_serial('/dev/ttyACM0')
+  prof.wrap(Tracer.session, ['request'], 'serial')
   if init_comms:
     if not Tracer.init_comm_link():
       print('failed to initialize TraceR comm link')
       exit(0)
   tr1 = Tracer(Tracer.TR1)
   tr2 = Tracer(Tracer.TR2)
-  tr = tr1 #TODO put this as argument
+  trs = { '1': [tr1], '2': [tr2], '12': [tr1, tr2] }[which]
 
-  
-  print('=== Initializing Keithley 195A GPIB Multimeter ===')
-  # Talking to a GPIB device 
-  # connected to a remote computer running custom server
-  HOST = '192.168.1.37'  # The server's hostname or IP address
-  PORT = 65432        # The port used by the server
-  device = keithley.Remote_device( HOST, PORT )
-  # open the meter device
-  dmm = keithley.K195A(device) 
-
-  dmm.clear()
-  time.sleep(0.100)
-
-  status = dmm.query('U0DX').strip()
-  print('status:', status)
-
-  dmm.write('F2X')
-  time.sleep(3.0)
-
-  dmm.write('R3X')
-  time.sleep(0.1)
-  dmm.write('P2X')
-  time.sleep(0.1)
-  dmm.write('S2X')
-  time.sleep(0.1)
-  dmm.write('T0X')
-  time.sleep(0.1)
-
-  status = dmm.query('U0DX').strip()
-  print('status:', status)
-  print('Waiting for the Keithley meter...', end='')
-  sys.stdout.flush()
-  reply = dmm.query('')
-  print(" okay, let's go!")
-
-  fpo = open('caldata.txt', 'w')
+  def open_meter(address=None):
+    dmm = keithley.get_meter(address=address)
+    prof.wrap(dmm.dev, ['write', 'read', 'query', 'clear'], 'gpib')
+    dmm.prepare_ohms()
+    return dmm
 
-  print('=== Performing calibration over all counts ===')
-  print(dt.datetime.now())
-  print('# Began on: ', dt.datetime.now(), file=fpo)
-  for count in range(257):
-
-    if count == 256:
-      tr.command(Tracer.COUNTS, 0)
-      tr.command(Tracer.RELAYS, 1)
-      print('# counts: relay shunted')
-      time.sleep(1.0)
-    else: 
-      tr.command(Tracer.COUNTS, count)
-      print('# counts:', tr.counts)
-
-    ohms = []
-    for loop in range(10):
-      reply = dmm.query('')
-      # qualify the reply...
-      # NOHM+0.01198E+3
-      ok_len = len(reply) >=7
-      if len(reply) >= 7:
-        prefix = reply[0]
-        mode = reply[1:4]
-        value = reply[4:].strip()
-        ok_prefix = prefix == 'N'
-        ok_mode = mode == 'OHM'
-        if ok_len and ok_prefix and ok_mode:
-          reading = float(value)
-          print('# Resistance', prefix, mode, value, reading )
-          ohms.append( reading )
-        else:
-          ohms = 0.0
-          print('# Bad format:', prefix, mode, value )
+  print('=== Initializing Keithley 195A GPIB Multimeter ===')
+  if dual:
+    dmms = [ open_meter(keithley.METER_ADDRESS[tr.which]) for tr in trs ]
+  else:
+    dmms = [ open_meter() ]
+
+  def read_ohms(tr, dmm):
+    # a point without a single good reading is measured again
+    ohms = dmm.take(10, bulk)
+    log.debug('# R%s Resistance %s', tr.which, ohms)
+    if len(ohms) < 10:
+      log.warning('# R%s Error: only %d good readings', tr.which, len(ohms))
+    return ohms
+
+  # file I/O happens on the writer's thread, fsync at checkpoints
+  if dual:
+    # one file per resistor, named like the ones calproc reads
+    fpos = []
+    for tr in trs:
+      tr.command(tr.IDENT)
+      calfile = 'tracer-'+tr.ident.lower()+'-r'+tr.which+'-cal.dat'
+      print('Opening:', calfile)
+      fpos.append(Result_writer(calfile))
+  else:
+    fpos = [ Result_writer('caldata.txt') ]
+  for fpo in fpos:
+    prof.wrap(fpo, ['write', 'flush', 'checkpoint', 'close'], 'io')
+
+  def sweep(tr, dmm, fpo):
+    if dual:
+      # names this channel's section of the --profile breakdown
+      threading.current_thread().name = 'R'+tr.which
+    for count in range(257):
+
+      if count == 256:
+        tr.command(Tracer.COUNTS, 0)
+        tr.command(Tracer.RELAYS, 1)
+        log.info('# R%s counts: relay shunted', tr.which)
+        time.sleep(1.0)
+      else: 
+        tr.command(Tracer.COUNTS, count)
+        log.info('# R%s counts: %s', tr.which, tr.counts)
+
+      sample = Sample.from_readings( count, read_ohms(tr, dmm) )
+      if sample.nsamples:
+        sample.print_row(fpo)
+        fpo.flush()
       else:
-        print('# Error:', reply )
-
-    print( count, 
-        f'{stats.mean(ohms):.2f}', 
-        f'{stats.stdev(ohms):.4f}',
-        len(ohms),
-        [o for o in ohms], 
-           sep='\t', file = fpo )
-    fpo.flush()
+        # a nan row would end up in the fit and the inverse table
+        log.error('# R%s counts %d: no good readings, point left out',
+                  tr.which, count)
 
-    if count == 256:
-      tr.command(Tracer.RELAYS, 0)
-      time.sleep(1.0)
+      if count == 256:
+        tr.command(Tracer.RELAYS, 0)
+        time.sleep(1.0)
 
-  print(dt.datetime.now())
-  print('# Ended on: ', dt.datetime.now(), file=fpo)
-  fpo.close()
+  print('=== Performing calibration over all counts ===')
+  begtime = dt.datetime.now()
+  print(begtime)
+  try:
+    for fpo in fpos:
+      print('# Began on: ', begtime, file=fpo)
+    if dual:
+      # one thread per resistor: the serial session interleaves their
+      # module commands, and each waits on its own meter while the
+      # other one is setting counts or reading
+      with prof.stage('channels'), \
+          ThreadPoolExecutor(max_workers=len(trs)) as pool:
+        jobs = [ pool.submit(sweep, tr, dmm, fpo)
+                 for tr, dmm, fpo in zip(trs, dmms, fpos) ]
+        for job in jobs:
+          job.result()
+    else:
+      sweep(trs[0], dmms[0], fpos[0])
+
+    endtime = dt.datetime.now()
+    print(endtime)
+    for fpo in fpos:
+      print('# Ended on: ', endtime, file=fpo)
+  finally:
+    # the points measured so far reach the disk even if the run fails
+    for fpo in fpos:
+      fpo.close()
+    prof.stop()
 
 if __name__ == "__main__":
-  main()
+  main(sys.argv)
 
@@ -1,14 +1,14 @@
 #!/usr/bin/env python
 
-import sys, glob
+import sys, os, glob
 from operator import itemgetter
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
 import csv
+import statistics as stats
 
 from inverse import Registers, Inverse
+from reclog import Record_reader
 
 class Sample:
   def __init__( self, counts, ohms, stdev, nsamples, samples ):
@@ -17,6 +17,25 @@ class Sample:
     self.stdev = stdev
     self.nsamples = nsamples
     self.samples = samples
+
+  @classmethod
+  def from_readings( cls, counts, readings ):
+    # one point from its good readings: mean, sample stdev, count;
+    # the stdev of a single reading is unknown, not zero, so nan
+    mean = stats.mean(readings) if readings else float('nan')
+    stdev = stats.stdev(readings) if len(readings) > 1 else float('nan')
+    return cls( counts, mean, stdev, len(readings), list(readings) )
+
+  def print_row( self, fp=sys.stdout ):
+    # one row of a tracer-...-cal.dat or rcheck-...-cal.dat file,
+    # readings to float32 precision, as the .rec logs keep them
+    print( self.counts,
+        f'{self.ohms:.2f}',
+        f'{self.stdev:.4f}',
+        self.nsamples,
+        [float(f'{o:.7g}') for o in self.samples],
+           sep='\t', file = fp )
+
   def __str__(self):
     return '{s.counts} {s.ohms}'.format(s=self)
   def __repr__(self):
@@ -26,17 +45,26 @@ class Sample:
   #   2    14.57    0.0052 10    [14.56, 14.56, 14.56, 14.56, 14.57, 14.57, 14.57, 14.57, 14.57, 14.57]
   #   3    15.80    0.0000 10    [15.8, 15.8, 15.8, 15.8, 15.8, 15.8, 15.8, 15.8, 15.8, 15.8]
 
+def invert_fname( serno, resno ):
+  # where calproc --invert writes a module's inverse table
+  # invert-sn0-r1-cal.dat
+  return f'data/invert-{serno.lower()}-{resno.lower()}-cal.dat'
+
 class Calib:
-  def __init__(self, fname=None):
+  def __init__(self, fname=None, raw=False):
     self.samples=[]
     self.fname = fname
     self.fname_parse( fname )
     self.inverse = Inverse()
     self.verbose = False
+    self.raw = raw    # keep the raw readings of text files too
     if fname is not None:
       self.load(fname)
 
   def load(self, fname):
+    if fname.endswith('.rec'):
+      self.load_log(fname)
+      return
     with open(fname, 'r') as fin:
       reader = csv.reader(fin, delimiter='\t')
       npoints=0
@@ -47,16 +75,34 @@ class Calib:
         ohms = float(row[1])
         stdev = float(row[2])
         nsamples = int(row[3])
+        if np.isnan(ohms):
+          # older runs wrote points without good readings as nan,
+          # they must not reach the fit or the inverse table
+          continue
         data = []
+        if self.raw and len(row) > 4 and row[4].strip('[] '):
+          data = [ float(v) for v in row[4].strip('[] ').split(',') ]
         self.samples.append( Sample( counts, ohms, stdev, nsamples, data ))
         npoints += 1
 
+  def load_log(self, fname):
+    # binary record log, see reclog; keeps the raw readings
+    log = Record_reader(fname)
+    self.serno = log.serno
+    self.resno = log.resno
+    for counts, ohms, stdev, data in log:
+      self.samples.append( Sample( counts, ohms, stdev, len(data), data ))
+
   def fname_parse( self, fn ):
     # Filename format for extracting label information
     # tracer-sn0-r1-cal.dat
     # tracer-sn0-r2-cal.dat
     # tracer-sn3-r2-cal.dat
-    fields = fn.split('-')
+    if fn is None:
+      self.serno = None
+      self.resno = None
+      return
+    fields = os.path.basename(fn).split('-')
     self.serno = fields[1].upper()
     self.resno = fields[2].upper()
 
@@ -65,13 +111,17 @@ class Calib:
     # invert-sn0-r1-regs.dat
     # invert-sn0-r2-regs.dat
     # invert-sn3-r2-regs.dat
-    self.fout =  f'data/invert-{self.serno.lower()}'\
-                 f'-{self.resno.lower()}-cal.dat'
+    self.fout = invert_fname( self.serno, self.resno )
     return self.fout
 
+  def measured( self ):
+    # the wiper count points that have readings; a count the sweep
+    # got none for is either missing or a row with no readings
+    return [ c for c in self.samples[:-1] if c.nsamples > 0 ]
+
   def linear_fit( self ):
-    self.x = [ c.counts for c in self.samples[:-1] ]
-    self.y = [ c.ohms   for c in self.samples[:-1] ]
+    self.x = [ c.counts for c in self.measured() ]
+    self.y = [ c.ohms   for c in self.measured() ]
     self.linfit = np.polyfit(self.x,self.y,1)
     self.predict = np.poly1d(self.linfit)
     self.xfit = range(0,256)
@@ -91,11 +141,12 @@ class Calib:
     radj = self.samples[-1].ohms
     rerr = radj
     self.inverse.regs.append(Registers( rnom, radj, rerr, regs ))
+    points = self.measured()
     for rnom in range(1,300):
       lo = None
       hi = None
-      c0 = self.samples[0]
-      for c in self.samples[1:-1]:
+      c0 = points[0]
+      for c in points[1:]:
         if rnom > c0.ohms and rnom <= c.ohms:
           lo=c0
           hi=c
@@ -112,9 +163,12 @@ class Calib:
         dhi = hi.ohms - rnom
         # 1.  adjust lo counts by 0, +1, +2, or +3
         # 2.  adjust hi counts by 0, -1, -2, or -3
+        # bumps step through counts between lo and hi, so only
+        # when they are next to each other, not across a gap left
+        # by a point that got no readings
         errlo = []
         errhi = []
-        for adjust in range(4):
+        for adjust in range(4 if hi.counts == lo.counts+1 else 1):
           rladj = lo.ohms + adjust*DELTA
           rhadj = hi.ohms - adjust*DELTA
           errlo.append( abs( rnom - rladj ) )
@@ -157,119 +211,62 @@ class Calib:
           #for r in regs: print( f'{r}', end='\t' )
           #print( f'{radj:.3f}', f'{rerr:+.3f}', sep='\t')
 
-  def plot_samples( self, ax ):
-    major_ticks_x = np.arange(0,257,32)
-    minor_ticks_x = np.arange(0,257,8)
-    major_ticks_y = np.arange(0,301,50)
-    minor_ticks_y = np.arange(0,301,10)
+  def tabulate( self ):
+    # Candidate register settings for the fine lookup: all four
+    # registers at a measured count c, with 0..3 of them bumped to c+1
+    # when c+1 was measured too.  Each bump adds a quarter of the
+    # measured step from c to c+1.  The shunt relay is one more
+    # candidate, marked with count -1.
+    points = self.measured()
+    ohms = np.array([ c.ohms for c in points ])
+    counts = np.array([ c.counts for c in points ])
+    nup = np.tile(np.arange(4), len(ohms))
+    step = np.repeat(np.append(np.diff(ohms), 0.0), 4)
+    nextto = np.repeat(np.append(np.diff(counts) == 1, False), 4)
+    keep = (nup == 0) | nextto
+    cand_ohms = np.append((np.repeat(ohms, 4) + nup*step/4)[keep], self.samples[-1].ohms)
+    cand_counts = np.append(np.repeat(counts, 4)[keep], -1)
+    nup = np.append(nup[keep], 0)
+    order = np.argsort(cand_ohms, kind='stable')
+    self.tab_ohms = cand_ohms[order]
+    self.tab_counts = cand_counts[order]
+    self.tab_nup = nup[order]
 
-    ax.set_title(f'Digipot {self.serno} {self.resno}')
-    ax.set_xlim(0,256)
-    ax.set_ylim(0,300)
-    ax.scatter(self.x,self.y)
-    ax.plot(self.xfit, self.yfit, c= 'r')
-    ax.set_xticks(major_ticks_x)
-    ax.set_xticks(minor_ticks_x, minor=True)
-    ax.set_yticks(major_ticks_y)
-    ax.set_yticks(minor_ticks_y, minor=True)
-    ax.grid(which='both')
-    ax.grid(which='minor', alpha=0.2)
-    ax.grid(which='major', alpha=0.5)
-    ax.set_xlabel('Digipot Wiper Setting, Counts')
-    ax.set_ylabel('Resistance, Ohms')
-    ax.text(12,260, ' slope: {:.3f}\noffset: {:.3f}'\
-                 .format(self.slope, self.offset), 
-                  bbox={'facecolor': 'blue', 'alpha': 0.2, 'pad': 4})
+  def lookup_batch( self, targets ):
+    # Best candidate for each target resistance, returns arrays of
+    # counts, number of registers bumped, and predicted resistance
+    if not hasattr(self, 'tab_ohms'): self.tabulate()
+    targets = np.asarray(targets, dtype=float)
+    ihi = np.clip(np.searchsorted(self.tab_ohms, targets), 1, len(self.tab_ohms)-1)
+    ilo = ihi - 1
+    dlo = np.abs(targets - self.tab_ohms[ilo])
+    dhi = np.abs(self.tab_ohms[ihi] - targets)
+    best = np.where(dlo <= dhi, ilo, ihi)
+    return self.tab_counts[best], self.tab_nup[best], self.tab_ohms[best]
 
-  def plot_registers( self, ax ):
-    major_ticks_x = np.arange(0,301,50)
-    minor_ticks_x = np.arange(0,301,10)
-    major_ticks_y = np.arange(0,257,32)
-    minor_ticks_y = np.arange(0,257,8)
+  def lookup( self, target ):
+    # Fine lookup of any (fractional) target resistance
+    counts, nup, ract = self.lookup_batch([target])
+    counts, nup, ract = int(counts[0]), int(nup[0]), float(ract[0])
+    if counts < 0:
+      return Registers( target, ract, target-ract, [0,0,0,0], relay=True )
+    regs = [counts+1]*nup + [counts]*(4-nup)
+    return Registers( target, ract, target-ract, regs )
 
-    x = [ r.rnom for r in self.inverse.regs ]
-    y0 = [ r.regs[0] for r in self.inverse.regs ]
-    y1 = [ r.regs[1] for r in self.inverse.regs ]
-    y2 = [ r.regs[2] for r in self.inverse.regs ]
-    y3 = [ r.regs[3] for r in self.inverse.regs ]
+  # Plotting lives in calplot, only imported when asked to plot
+  def plot_samples( self, ax ):
+    import calplot
+    calplot.plot_samples( self, ax )
 
-    ax.set_title(f'Registers {self.serno} {self.resno}')
-    ax.set_xlim(0,300)
-    ax.set_ylim(0,256)
-    ax.scatter(x,y0)
-    ax.scatter(x,y1)
-    ax.scatter(x,y2)
-    ax.scatter(x,y3)
-    ax.set_xticks(major_ticks_x)
-    ax.set_xticks(minor_ticks_x, minor=True)
-    ax.set_yticks(major_ticks_y)
-    ax.set_yticks(minor_ticks_y, minor=True)
-    ax.grid(which='both')
-    ax.grid(which='minor', alpha=0.2)
-    ax.grid(which='major', alpha=0.5)
-    ax.set_xlabel('Nominal Resistance, Ohms')
-    ax.set_ylabel('Digipot Register Settings, Counts')
+  def plot_registers( self, ax ):
+    import calplot
+    calplot.plot_registers( self, ax )
 
   def plot_errors( self, ax ):
-    major_ticks_x = np.arange(0,301,50)
-    minor_ticks_x = np.arange(0,301,10)
-    major_ticks_y = np.arange(-0.5,+0.5,0.10)
-    minor_ticks_y = np.arange(-0.5,+0.5,0.05)
-
-    x = [ r.rnom for r in self.inverse.regs ]
-    y = [ r.rerr for r in self.inverse.regs ]
-
-    ax.set_title(f'Errors for {self.serno} {self.resno}')
-    ax.set_xlim(0,300)
-    ax.set_ylim(-0.5,+0.5)
-    ax.scatter(x,y)
-    ax.set_xticks(major_ticks_x)
-    ax.set_xticks(minor_ticks_x, minor=True)
-    ax.set_yticks(major_ticks_y)
-    ax.set_yticks(minor_ticks_y, minor=True)
-    ax.grid(which='both')
-    ax.grid(which='minor', alpha=0.2)
-    ax.grid(which='major', alpha=0.5)
-    ax.set_ylabel('Resistance Error, Ohms')
-    ax.set_xlabel('Commanded Resistance, Ohms')
-    ax.text(12,260, ' slope: {:.3f}\noffset: {:.3f}'\
-                 .format(self.slope, self.offset), 
-                  bbox={'facecolor': 'blue', 'alpha': 0.2, 'pad': 4})
-
+    import calplot
+    calplot.plot_errors( self, ax )
 
   def plot_check( self, ax ):
-    major_ticks_x = np.arange(0,301,50)
-    minor_ticks_x = np.arange(0,301,10)
-    major_ticks_y = np.arange(0,301,50)
-    minor_ticks_y = np.arange(0,301,10)
-
-    x = [ c.counts for c in self.samples[:-1] ]
-    y = [ c.ohms   for c in self.samples[:-1] ]
-    y2 = np.subtract(y,x)
-
-
-    ax.set_title(f'Digipot {self.serno} {self.resno}')
-    ax.set_xlim(0,300)
-    ax.set_ylim(0,300)
-    ax.plot(x,y, c='b')
-    ax.set_xticks(major_ticks_x)
-    ax.set_xticks(minor_ticks_x, minor=True)
-    ax.set_yticks(major_ticks_y)
-    ax.set_yticks(minor_ticks_y, minor=True)
-    ax.tick_params(axis='y', labelcolor='b')
-    ax.grid(which='both')
-    ax.grid(which='minor', alpha=0.2)
-    ax.grid(which='major', alpha=0.5)
-    ax.set_xlabel('Commanded Resistance, Ohms')
-    ax.set_ylabel('Measured Resistance, Ohms', c='b')
-
-    ax2 = ax.twinx()
-    ax2.tick_params(axis='y', labelcolor='g')
-    ax2.set_ylim(-1.5, 1.5)
-    ax2.set_ylabel('Difference, Ohms', c='g')
-    ax2.plot(x,y2, c='g')
-    y3 = [0,0]
-    x3 = [0,300]
-    ax2.plot(x3,y3, 'g', alpha=0.35, linewidth=1)
-
+    import calplot
+    calplot.plot_check( self, ax )
 
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# Plotting for calproc.  Kept apart from calibration so the numeric
+# modes (--stats, --invert, --itest) never pay for importing matplotlib.
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+def setup_figure( nfiles ):
+  if nfiles <= 2:
+    nprows = 1
+    npcols = nfiles
+  else:
+    npcols = 2
+    nprows = int(0.5+(nfiles/2))
+
+  if nprows == 1: 
+    if npcols == 1:
+      vsize = 6
+      hsize = 10
+    else:
+      vsize = 5
+      hsize = 7*npcols
+  else:           
+    vsize = 3*nprows
+    hsize = 6*npcols
+
+  fig, ax = plt.subplots(nrows=nprows, ncols=npcols,
+               figsize=(hsize,vsize))
+  title = 'TraceR Calibration Data'
+  fig.canvas.manager.set_window_title('tracer-calibration')
+  fig.suptitle(title, fontsize=20, fontweight='bold')
+  if nprows == 1:
+    if nfiles == 1: ax = [ax]
+  else:
+    if nfiles == 1: ax = [[ax],[]]
+  return fig, ax, nprows
+
+def finish_figure( fig ):
+  fig.tight_layout(pad=1, w_pad = 1, h_pad = 1)
+  plt.show()
+  fig.savefig('plot.pdf')
+  fig.savefig('plot.png')
+
+def plot_samples( calib, ax ):
+  major_ticks_x = np.arange(0,257,32)
+  minor_ticks_x = np.arange(0,257,8)
+  major_ticks_y = np.arange(0,301,50)
+  minor_ticks_y = np.arange(0,301,10)
+
+  ax.set_title(f'Digipot {calib.serno} {calib.resno}')
+  ax.set_xlim(0,256)
+  ax.set_ylim(0,300)
+  ax.scatter(calib.x,calib.y)
+  ax.plot(calib.xfit, calib.yfit, c= 'r')
+  ax.set_xticks(major_ticks_x)
+  ax.set_xticks(minor_ticks_x, minor=True)
+  ax.set_yticks(major_ticks_y)
+  ax.set_yticks(minor_ticks_y, minor=True)
+  ax.grid(which='both')
+  ax.grid(which='minor', alpha=0.2)
+  ax.grid(which='major', alpha=0.5)
+  ax.set_xlabel('Digipot Wiper Setting, Counts')
+  ax.set_ylabel('Resistance, Ohms')
+  ax.text(12,260, ' slope: {:.3f}\noffset: {:.3f}'\
+               .format(calib.slope, calib.offset), 
+                bbox={'facecolor': 'blue', 'alpha': 0.2, 'pad': 4})
+
+def plot_registers( calib, ax ):
+  major_ticks_x = np.arange(0,301,50)
+  minor_ticks_x = np.arange(0,301,10)
+  major_ticks_y = np.arange(0,257,32)
+  minor_ticks_y = np.arange(0,257,8)
+
+  x = [ r.rnom for r in calib.inverse.regs ]
+  y0 = [ r.regs[0] for r in calib.inverse.regs ]
+  y1 = [ r.regs[1] for r in calib.inverse.regs ]
+  y2 = [ r.regs[2] for r in calib.inverse.regs ]
+  y3 = [ r.regs[3] for r in calib.inverse.regs ]
+
+  ax.set_title(f'Registers {calib.serno} {calib.resno}')
+  ax.set_xlim(0,300)
+  ax.set_ylim(0,256)
+  ax.scatter(x,y0)
+  ax.scatter(x,y1)
+  ax.scatter(x,y2)
+  ax.scatter(x,y3)
+  ax.set_xticks(major_ticks_x)
+  ax.set_xticks(minor_ticks_x, minor=True)
+  ax.set_yticks(major_ticks_y)
+  ax.set_yticks(minor_ticks_y, minor=True)
+  ax.grid(which='both')
+  ax.grid(which='minor', alpha=0.2)
+  ax.grid(which='major', alpha=0.5)
+  ax.set_xlabel('Nominal Resistance, Ohms')
+  ax.set_ylabel('Digipot Register Settings, Counts')
+
+def plot_errors( calib, ax ):
+  major_ticks_x = np.arange(0,301,50)
+  minor_ticks_x = np.arange(0,301,10)
+  major_ticks_y = np.arange(-0.5,+0.5,0.10)
+  minor_ticks_y = np.arange(-0.5,+0.5,0.05)
+
+  x = [ r.rnom for r in calib.inverse.regs ]
+  y = [ r.rerr for r in calib.inverse.regs ]
+
+  ax.set_title(f'Errors for {calib.serno} {calib.resno}')
+  ax.set_xlim(0,300)
+  ax.set_ylim(-0.5,+0.5)
+  ax.scatter(x,y)
+  ax.set_xticks(major_ticks_x)
+  ax.set_xticks(minor_ticks_x, minor=True)
+  ax.set_yticks(major_ticks_y)
+  ax.set_yticks(minor_ticks_y, minor=True)
+  ax.grid(which='both')
+  ax.grid(which='minor', alpha=0.2)
+  ax.grid(which='major', alpha=0.5)
+  ax.set_ylabel('Resistance Error, Ohms')
+  ax.set_xlabel('Commanded Resistance, Ohms')
+  ax.text(12,260, ' slope: {:.3f}\noffset: {:.3f}'\
+               .format(calib.slope, calib.offset), 
+                bbox={'facecolor': 'blue', 'alpha': 0.2, 'pad': 4})
+
+
+def plot_check( calib, ax ):
+  major_ticks_x = np.arange(0,301,50)
+  minor_ticks_x = np.arange(0,301,10)
+  major_ticks_y = np.arange(0,301,50)
+  minor_ticks_y = np.arange(0,301,10)
+
+  x = [ c.counts for c in calib.samples[:-1] ]
+  y = [ c.ohms   for c in calib.samples[:-1] ]
+  y2 = np.subtract(y,x)
+
+
+  ax.set_title(f'Digipot {calib.serno} {calib.resno}')
+  ax.set_xlim(0,300)
+  ax.set_ylim(0,300)
+  ax.plot(x,y, c='b')
+  ax.set_xticks(major_ticks_x)
+  ax.set_xticks(minor_ticks_x, minor=True)
+  ax.set_yticks(major_ticks_y)
+  ax.set_yticks(minor_ticks_y, minor=True)
+  ax.tick_params(axis='y', labelcolor='b')
+  ax.grid(which='both')
+  ax.grid(which='minor', alpha=0.2)
+  ax.grid(which='major', alpha=0.5)
+  ax.set_xlabel('Commanded Resistance, Ohms')
+  ax.set_ylabel('Measured Resistance, Ohms', c='b')
+
+  ax2 = ax.twinx()
+  ax2.tick_params(axis='y', labelcolor='g')
+  ax2.set_ylim(-1.5, 1.5)
+  ax2.set_ylabel('Difference, Ohms', c='g')
+  ax2.plot(x,y2, c='g')
+  y3 = [0,0]
+  x3 = [0,300]
+  ax2.plot(x3,y3, 'g', alpha=0.35, linewidth=1)
+
+def save_page( calib, fname ):
+  # one module's calibration and errors side by side, for calproc --watch
+  fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(14,5))
+  fig.suptitle(f'TraceR {calib.serno} {calib.resno}', fontsize=16, fontweight='bold')
+  plot_samples( calib, ax[0] )
+  plot_errors( calib, ax[1] )
+  fig.tight_layout(pad=1, w_pad = 1, h_pad = 1)
+  fig.savefig(fname)
+  plt.close(fig)
@@ -1,15 +1,18 @@
 #!/usr/bin/env python
 
-import sys, glob
-from operator import itemgetter
+import time
+t_start = time.perf_counter()
+
+import sys
 import argparse
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-import csv
 
 from inverse import Registers, Inverse
 from calibration import Sample, Calib
+from profiling import Profiler
+
+# time from the first line of this module until the command line is
+# parsed, matplotlib is only imported later for the plot modes
+STARTUP_BUDGET = 0.250  # seconds
 
 def main( argv ):
 
@@ -19,15 +22,30 @@ def main( argv ):
   parser = argparse.ArgumentParser(description=descr, epilog=epilog)
   parser.add_argument('--stats', action='store_true', help='Summarize calibration(s) statistics')
   parser.add_argument('--invert', action='store_true', help='Calc and save inverse function register values')
+  parser.add_argument('--export', action='store_true', help='Save inverse function as compact binary image (.bin)')
   parser.add_argument('--plotcal', action='store_true', help='Plot cal(s) measured data, Ract vs counts')
   parser.add_argument('--plotregs', action='store_true', help='Plot inverse(s) register values, countsx4 vs Rnom')
   parser.add_argument('--ploterrs', action='store_true', help='Plot inverse(s) error values, |Radj-Rnom|')
   parser.add_argument('--plotchk', action='store_true', help='Plot check measurements, Rmeas vs Rcmd')
   parser.add_argument('--itest', action='store_true', help='Read and print inverse function cal file')
+  parser.add_argument('--build', metavar='DIR', help='Rebuild outputs of changed cal files in DIR, then exit')
+  parser.add_argument('--watch', metavar='DIR', help='Keep rebuilding outputs of changed cal files in DIR')
+  parser.add_argument('--pages', action='store_true', help='With --build/--watch, also save a plot page per cal file')
+  parser.add_argument('--profile', action='store_true', help='Profile the run, write calproc.prof/.collapsed/.stages')
+  parser.add_argument('--startup', action='store_true', help='Report startup time against its budget')
   parser.add_argument('calfiles', type=argparse.FileType('r'), nargs='*', help='Cal data file(s)')
   
   args = parser.parse_args()
   nfiles = len(args.calfiles)
+
+  if args.build or args.watch:
+    from watch import Builder
+    if args.watch:
+      # wait for files to settle, stations may still be writing them
+      Builder( args.watch, args.pages, settle=5.0 ).watch()
+    else:
+      Builder( args.build, args.pages ).build()
+    sys.exit(0)
   if len(sys.argv)==1 or nfiles==0: # no command line arguments, print help
     parser.print_help(sys.stderr)
     sys.exit(0)
@@ -38,6 +56,16 @@ def main( argv ):
   ####   print(f.name, f.mode)
   #### exit(0)
 
+  if args.startup:
+    t_startup = time.perf_counter() - t_start
+    print(f'# startup {1000*t_startup:.1f} ms, '
+          f'budget {1000*STARTUP_BUDGET:.0f} ms', file=sys.stderr)
+    if t_startup > STARTUP_BUDGET:
+      print('# startup over budget', file=sys.stderr)
+
+  prof = Profiler('calproc', args.profile)
+  prof.start()
+
   verbose = False
   plotsetup = args.plotcal or args.plotregs or args.ploterrs or args.plotchk
 
@@ -46,39 +74,9 @@ def main( argv ):
     print( f'# S/N\tR#\tSlope\tOffset\tRmin\tRmax\tNres')
 
   if plotsetup:
-    if nfiles <= 2:
-      nprows = 1
-      npcols = nfiles
-    else:
-      npcols = 2
-      nprows = int(0.5+(nfiles/2))
-
-    if nprows == 1: 
-      if npcols == 1:
-        vsize = 6
-        hsize = 10
-      else:
-        vsize = 5
-        hsize = 7*npcols
-    else:           
-      vsize = 3*nprows
-      hsize = 6*npcols
-
-
-    fig, ax = plt.subplots(nrows=nprows, ncols=npcols,
-                 figsize=(hsize,vsize))
-    title = 'TraceR Calibration Data'
-    fig.canvas.manager.set_window_title('tracer-calibration')
-    fig.suptitle(title, fontsize=20, fontweight='bold')
-    if nprows == 1:
-      if nfiles == 1: ax = [ax]
-    else:
-      if nfiles == 1: ax = [[ax],[]]
-    # print(len(ax))
-    # print('nfiles:', nfiles)
-    # print('nprows:', nprows)
-    # print('npcols:', npcols)
-    # breakpoint()
+    with prof.stage('plot'):
+      import calplot
+      fig, ax, nprows = calplot.setup_figure( nfiles )
 
   iprow=0
   ipcol=0
@@ -86,65 +84,78 @@ def main( argv ):
     fname = ftype.name
 
     if args.itest:
-      inverse = Inverse( fname )
+      with prof.stage('load'):
+        inverse = Inverse( fname )
     elif args.plotchk:
       #this isn't really calibration data
       # the "counts" of the rcheck file 
       # contains the commanded resistance value
-      calib = Calib( fname )
+      with prof.stage('load'):
+        calib = Calib( fname )
     else:
-      calib = Calib( fname )
-      calib.linear_fit()
-      calib.invert()
-
-    if args.plotcal:
-      if nprows==1:
-        calib.plot_samples( ax[ipcol] )
-      else:
-        calib.plot_samples( ax[iprow][ipcol] )
-
-    if args.plotregs:
-      if nprows==1:
-        calib.plot_registers( ax[ipcol] )
-      else:
-        calib.plot_registers( ax[iprow][ipcol] )
-
-    if args.ploterrs:
-      if nprows==1:
-        calib.plot_errors( ax[ipcol] )
-      else:
-        calib.plot_errors( ax[iprow][ipcol] )
-
-    if args.plotchk:
-      if nprows==1:
-        calib.plot_check( ax[ipcol] )
-      else:
-        calib.plot_check( ax[iprow][ipcol] )
+      with prof.stage('load'):
+        calib = Calib( fname )
+      with prof.stage('fit'):
+        calib.linear_fit()
+      with prof.stage('invert'):
+        calib.invert()
+
+    with prof.stage('plot'):
+      if args.plotcal:
+        if nprows==1:
+          calib.plot_samples( ax[ipcol] )
+        else:
+          calib.plot_samples( ax[iprow][ipcol] )
+
+      if args.plotregs:
+        if nprows==1:
+          calib.plot_registers( ax[ipcol] )
+        else:
+          calib.plot_registers( ax[iprow][ipcol] )
+
+      if args.ploterrs:
+        if nprows==1:
+          calib.plot_errors( ax[ipcol] )
+        else:
+          calib.plot_errors( ax[iprow][ipcol] )
+
+      if args.plotchk:
+        if nprows==1:
+          calib.plot_check( ax[ipcol] )
+        else:
+          calib.plot_check( ax[iprow][ipcol] )
 
     ipcol += 1
     if ipcol >= 2:
       ipcol = 0
       iprow += 1
 
-    if args.invert:
-      fout = calib.fname_output()
-      print('Writing reg filename:', fout)
-      with open( fout, 'w') as fp:
-        calib.inverse.print_all(fp)
+    with prof.stage('write'):
+      if args.invert:
+        fout = calib.fname_output()
+        print('Writing reg filename:', fout)
+        with open( fout, 'w') as fp:
+          calib.inverse.print_all(fp)
 
-    if args.stats:
-      print( f'{calib.serno}\t{calib.resno}\t'\
-             f'{calib.slope:.3f}\t{calib.offset:.3f}\t'\
-             f'{calib.inverse.rbeg}\t{calib.inverse.rend}\t{calib.inverse.nres}')
+      if args.export:
+        fout = calib.fname_output()[:-len('.dat')] + '.bin'
+        print('Writing image filename:', fout)
+        with open( fout, 'wb') as fp:
+          fp.write(calib.inverse.pack())
 
-    if args.itest:
-      inverse.print_all()
+      if args.stats:
+        print( f'{calib.serno}\t{calib.resno}\t'\
+               f'{calib.slope:.3f}\t{calib.offset:.3f}\t'\
+               f'{calib.inverse.rbeg}\t{calib.inverse.rend}\t{calib.inverse.nres}')
+
+      if args.itest:
+        inverse.print_all()
 
   if plotsetup:
-    fig.tight_layout(pad=1, w_pad = 1, h_pad = 1)
-    plt.show()
-    fig.savefig('plot.pdf')
-    fig.savefig('plot.png')
+    with prof.stage('plot'):
+      calplot.finish_figure( fig )
+
+  prof.stop()
 
 if __name__ == "__main__":
   main(sys.argv)
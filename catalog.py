@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+import datetime as dt
+from collections import namedtuple
+
+from reclog import Record_reader
+
+# Catalog of the module files in a data directory, so tools can ask
+# "latest calibration of SN42" or "everything calibrated this week"
+# without globbing and re-parsing file names and headers.
+#
+#   tracer-snN-rM-cal.dat/.rec  ->  kind 'cal'
+#   invert-snN-rM-cal.dat/.bin  ->  kind 'invert'
+#   rcheck-snN-rM-cal.dat       ->  kind 'rcheck'
+#   uncert-snN-rM-cal.dat       ->  kind 'uncert'
+#
+# Each file is kept with its serial and resistor (upper case, as in
+# Calib), the time from its '# Began on:' header (or the record log
+# header), its size and mtime, and a SHA-256 of its contents.  The
+# catalog is an sqlite database in the data directory, indexed on
+# module and time.  update() only re-reads files whose size or mtime
+# changed, the same signature the calproc build uses.
+
+CATALOG_FILE = '.catalog.sqlite'
+KINDS = { 'tracer': 'cal', 'invert': 'invert',
+          'rcheck': 'rcheck', 'uncert': 'uncert' }
+EXTENSIONS = ('.dat', '.rec', '.bin')
+BEGAN = '# Began on:'
+
+Entry = namedtuple('Entry', 'name serno resno kind began mtime size sha256')
+
+SCHEMA = """
+create table if not exists files (
+  name text primary key, serno text, resno text, kind text,
+  began real, mtime_ns integer, size integer, sha256 text );
+create index if not exists files_module on files (serno, resno, kind);
+create index if not exists files_time on files (began);
+"""
+
+def name_parse( name ):
+  """Returns (serno, resno, kind) of a module file name, or None"""
+  base, ext = os.path.splitext(name)
+  fields = base.split('-')
+  if ext not in EXTENSIONS or len(fields) != 4 or fields[0] not in KINDS:
+    return None
+  return fields[1].upper(), fields[2].upper(), KINDS[fields[0]]
+
+def began_time( path ):
+  """Start of the run in epoch seconds, or None if the file has none"""
+  if path.endswith('.rec'):
+    return Record_reader(path).began
+  if path.endswith('.bin'):
+    return None
+  with open(path, 'r') as fin:
+    for line in fin:
+      if line.startswith(BEGAN):
+        return dt.datetime.fromisoformat(line[len(BEGAN):].strip()).timestamp()
+      if not line.startswith('#'):
+        return None   # headers only come first
+  return None
+
+def file_hash( path ):
+  digest = hashlib.sha256()
+  with open(path, 'rb') as fin:
+    for block in iter(lambda: fin.read(1<<16), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+class Catalog:
+
+  def __init__( self, datadir, verbose=False ):
+    self.datadir = datadir
+    self.verbose = verbose
+    self.db = sqlite3.connect(os.path.join(datadir, CATALOG_FILE))
+    self.db.executescript(SCHEMA)
+
+  def scan( self ):
+    # one directory listing, stat info comes with it
+    found = {}
+    with os.scandir(self.datadir) as it:
+      for entry in it:
+        if name_parse(entry.name) is not None:
+          st = entry.stat()
+          found[entry.name] = (st.st_mtime_ns, st.st_size)
+    return found
+
+  def update( self ):
+    """Brings the catalog up to date, returns (changed, removed) names"""
+    found = self.scan()
+    known = { name: (mtime, size) for name, mtime, size in
+              self.db.execute('select name, mtime_ns, size from files') }
+    changed, removed = [], []
+    with self.db:
+      for name, sig in sorted(found.items()):
+        if known.get(name) == sig:
+          continue
+        path = os.path.join(self.datadir, name)
+        try:
+          began = began_time(path)
+          sha256 = file_hash(path)
+        except (OSError, ValueError) as e:
+          if self.verbose: print('Failed:', name, e)
+          continue
+        serno, resno, kind = name_parse(name)
+        self.db.execute('insert or replace into files values (?,?,?,?,?,?,?,?)',
+                        (name, serno, resno, kind, began, sig[0], sig[1], sha256))
+        changed.append(name)
+        if self.verbose: print('Cataloged:', name)
+      for name in known:
+        if name not in found:
+          self.db.execute('delete from files where name = ?', (name,))
+          removed.append(name)
+          if self.verbose: print('Removed:', name)
+    return changed, removed
+
+  def query( self, serno=None, resno=None, kind=None, since=None, until=None ):
+    """
+    Returns the matching Entries, newest first.  since and until are
+    epoch seconds, compared with the run's start time, or with the
+    file's mtime for files without one (inverse tables).
+    """
+    when = 'coalesce(began, mtime_ns/1e9)'
+    where, args = [], []
+    for column, value in (('serno', serno), ('resno', resno), ('kind', kind)):
+      if value is not None:
+        where.append(f'{column} = ?')
+        args.append(value.upper() if column != 'kind' else value)
+    if since is not None:
+      where.append(f'{when} >= ?')
+      args.append(since)
+    if until is not None:
+      where.append(f'{when} < ?')
+      args.append(until)
+    sql = f'select name, serno, resno, kind, began, {when}, size, sha256 from files'
+    if where:
+      sql += ' where ' + ' and '.join(where)
+    sql += f' order by {when} desc, name'
+    return [ Entry(*row) for row in self.db.execute(sql, args) ]
+
+  def latest( self, serno, resno=None, kind='cal' ):
+    """The newest Entry of a module, or None"""
+    entries = self.query(serno, resno, kind)
+    return entries[0] if entries else None
+
+  def path( self, entry ):
+    return os.path.join(self.datadir, entry.name)
+
+  def watch( self, interval=2.0 ):
+    while True:
+      self.update()
+      time.sleep(interval)
+
+  def close( self ):
+    self.db.close()
+
+  def __enter__( self ):
+    return self
+
+  def __exit__( self, *exc ):
+    self.close()
+
+def print_entries( entries, fp=sys.stdout ):
+  print('# File\tS/N\tR#\tKind\tBegan\tSHA-256', file=fp)
+  for e in entries:
+    began = dt.datetime.fromtimestamp(e.began).isoformat(' ', 'seconds') \
+            if e.began is not None else '-'
+    print(e.name, e.serno, e.resno, e.kind, began, e.sha256[:12],
+          sep='\t', file=fp)
+
+def main(argv):
+  descr = 'Catalog of TraceR module files in a data directory'
+  parser = argparse.ArgumentParser(description=descr)
+  parser.add_argument('datadir', help='Data directory')
+  parser.add_argument('--sn', help='Serial number, e.g. SN0')
+  parser.add_argument('--res', help='Resistor, R1 or R2')
+  parser.add_argument('--kind', choices=sorted(set(KINDS.values())), help='Kind of file')
+  parser.add_argument('--days', type=float, help='Only files from the last DAYS days')
+  parser.add_argument('--latest', action='store_true', help='Only the newest matching file')
+  parser.add_argument('--no-update', action='store_true', help='Query without updating first')
+  parser.add_argument('--watch', action='store_true', help='Keep the catalog updated')
+  parser.add_argument('--verbose', '-v', action='store_true', help='Print catalog changes')
+  args = parser.parse_args(argv[1:])
+
+  with Catalog( args.datadir, args.verbose ) as catalog:
+    if args.watch:
+      catalog.watch()
+    if not args.no_update:
+      catalog.update()
+    since = time.time() - 86400*args.days if args.days is not None else None
+    entries = catalog.query( args.sn, args.res, args.kind, since )
+    if args.latest:
+      entries = entries[:1]
+    print_entries( entries )
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -1,29 +1,61 @@
 #!/usr/bin/env python3
 
 from tracer import Tracer
+from inverse import Inverse
+from calibration import Sample, invert_fname
+from seqcheck import Sequential_check
+from writer import Result_writer
+from profiling import Profiler
+import tracer
 import keithley
+import os
 import time
 import datetime as dt
 import sys
-import statistics as stats
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger('check')
 
 def main(argv):
 
+  # silent by default, -v for progress, -vv for every reading
+  level = logging.WARNING
+  if '-v' in argv: level = logging.INFO
+  if '-vv' in argv: level = logging.DEBUG
+  logging.basicConfig(level=level, format='%(message)s')
+
+  # --profile: time serial, GPIB, settling sleeps and file I/O
+  prof = Profiler('check', '--profile' in argv)
+  prof.wrap(time, ['sleep'], 'settle')
+  prof.wrap(tracer, ['sleep'], 'settle')
+  prof.start()
+
+  # --sampled: check random targets until pass/fail is decided,
+  # and only run the full check over all targets if it fails
+  sampled = '--sampled' in argv
+  argv = [ a for a in argv if a not in ('--sampled', '--profile', '-v', '-vv') ]
+
+  # '12' checks both resistors concurrently, each on its own meter
   if len(argv) < 2:
-    print('Usage: check <1,2>   for R1 or R2')
+    print('Usage: check <1,2,12> [--sampled] [--profile] [-v|-vv]   for R1, R2 or both')
     exit(0)
-  if argv[1] != '1' and argv[1] != '2':
-    print('Error, must specify R1 or R2')
-    print('Usage: check <1,2>   for R1 or R2')
+  if argv[1] not in ('1', '2', '12'):
+    print('Error, must specify R1, R2 or both')
+    print('Usage: check <1,2,12> [--sampled] [--profile] [-v|-vv]   for R1, R2 or both')
     exit(0)
+  dual = argv[1] == '12'
 
   if len(argv) > 2:
     init_comms = '1' == argv[2]
   else:
     init_comms = True
+  bulk = False # data store fetch, not yet tried on a real meter
 
   print('=== Initializing TraceR Module ===')
   Tracer.init_serial('/dev/ttyACM0')
+  prof.wrap(Tracer.session, ['request'], 'serial')
   if init_comms:
     if not Tracer.init_comm_link():
       print('failed to initialize TraceR comm link')
@@ -31,97 +63,111 @@ def main(argv):
   tr1 = Tracer(Tracer.TR1)
   tr2 = Tracer(Tracer.TR2)
 
-  if argv[1] == '1':
-    tr = tr1 
-  elif argv[1] == '2':
-    tr = tr2 
-
-  # get serial number and make filename
-  tr.command(tr.IDENT)
-  chkfile = 'rcheck-'+tr.ident.lower()+'-r'+tr.which+'-cal.dat'
-  print('Opening:', chkfile)
-  fpo = open(chkfile, 'w')
-  
+  trs = { '1': [tr1], '2': [tr2], '12': [tr1, tr2] }[argv[1]]
+
+  # get serial number and make filenames
+  fpos = []
+  for tr in trs:
+    tr.command(tr.IDENT)
+    chkfile = 'rcheck-'+tr.ident.lower()+'-r'+tr.which+'-cal.dat'
+    print('Opening:', chkfile)
+    # file I/O happens on the writer's thread, fsync at checkpoints
+    fpo = Result_writer(chkfile)
+    prof.wrap(fpo, ['write', 'flush', 'checkpoint', 'close'], 'io')
+    fpos.append(fpo)
+
+  def open_meter(address=None):
+    dmm = keithley.get_meter(address=address)
+    prof.wrap(dmm.dev, ['write', 'read', 'query', 'clear'], 'gpib')
+    dmm.prepare_ohms()
+    return dmm
+
   print('=== Initializing Keithley 195A GPIB Multimeter ===')
-  # Talking to a GPIB device 
-  # connected to a remote computer running custom server
-  HOST = '192.168.1.37'  # The server's hostname or IP address
-  PORT = 65432        # The port used by the server
-  device = keithley.Remote_device( HOST, PORT )
-  # open the meter device
-  dmm = keithley.K195A(device) 
-
-  dmm.clear()
-  time.sleep(0.100)
-
-  status = dmm.query('U0DX').strip()
-  print('status:', status)
-
-  dmm.write('F2X')
-  time.sleep(3.0)
-
-  dmm.write('R3X')
-  time.sleep(0.1)
-  dmm.write('P2X')
-  time.sleep(0.1)
-  dmm.write('S2X')
-  time.sleep(0.1)
-  dmm.write('T0X')
-  time.sleep(0.1)
-
-  status = dmm.query('U0DX').strip()
-  print('status:', status)
-  print('Waiting for the Keithley meter...', end='')
-  sys.stdout.flush()
-  reply = dmm.query('')
-  print(" okay, let's go!")
-
-
-  print('=== Performing calibration check over all counts ===')
-  begtime = str( dt.datetime.now() )
-  print('# Began on: ', begtime )
-  print('# Began on: ', begtime, file=fpo)
-  for rcmd in range(0,300):
-
-    tr.command(Tracer.OHMS, rcmd)
-    print('# rcmd, ohms:', rcmd, tr.ohms)
-
-    ohms = []
-    for loop in range(10):
-      reply = dmm.query('')
-      # qualify the reply...
-      # NOHM+0.01198E+3
-      ok_len = len(reply) >=7
-      if len(reply) >= 7:
-        prefix = reply[0]
-        mode = reply[1:4]
-        value = reply[4:].strip()
-        ok_prefix = prefix == 'N'
-        ok_mode = mode == 'OHM'
-        if ok_len and ok_prefix and ok_mode:
-          reading = float(value)
-          print('# Resistance', prefix, mode, value, reading )
-          ohms.append( reading )
-        else:
-          ohms = 0.0
-          print('# Bad format:', prefix, mode, value )
+  if dual:
+    dmms = [ open_meter(keithley.METER_ADDRESS[tr.which]) for tr in trs ]
+  else:
+    dmms = [ open_meter() ]
+
+  def check_resistor(tr, dmm, fpo):
+    if dual:
+      # names this channel's section of the --profile breakdown
+      threading.current_thread().name = 'R'+tr.which
+
+    def measure(rcmd):
+      tr.command(Tracer.OHMS, rcmd)
+      log.info('# R%s rcmd, ohms: %s %s', tr.which, rcmd, tr.ohms)
+      # a target without a single good reading is measured again
+      ohms = dmm.take(10, bulk)
+      log.debug('# R%s Resistance %s', tr.which, ohms)
+      if len(ohms) < 10:
+        log.warning('# R%s Error: only %d good readings', tr.which, len(ohms))
+      return ohms
+
+    exhaustive = True
+    if sampled:
+      print(f'=== Performing sampled calibration check of R{tr.which} ===')
+      # check only inside the calibrated range, if we have its table
+      invfile = invert_fname( tr.ident, 'r'+tr.which )
+      if os.path.exists(invfile):
+        inverse = Inverse(invfile)
+        lo, hi = int(inverse.rbeg), int(inverse.rend)
       else:
-        print('# Error:', reply )
+        lo, hi = 15, 265
+      check = Sequential_check(measure, lo, hi)
+      decision = check.run()
+      print(f'# R{tr.which} Sampled check:', decision, 'after', len(check.results),
+            'targets,', check.nfail, 'failed')
+      print('# Sampled check:', decision, 'after', len(check.results),
+            'targets,', check.nfail, 'failed', file=fpo)
+      if decision == Sequential_check.PASS:
+        check.print_rows(fpo)
+        fpo.checkpoint()
+        exhaustive = False
+      else:
+        print(f'=== Sampled check of R{tr.which} did not pass, checking all targets ===')
 
-    print( rcmd, 
-        f'{stats.mean(ohms):.2f}', 
-        f'{stats.stdev(ohms):.4f}',
-        len(ohms),
-        [o for o in ohms], 
-           sep='\t', file = fpo )
-    fpo.flush()
+    if exhaustive:
+      print(f'=== Performing calibration check of R{tr.which} over all counts ===')
+      for rcmd in range(0,300):
 
+        sample = Sample.from_readings( rcmd, measure(rcmd) )
+        if sample.nsamples:
+          sample.print_row(fpo)
+          fpo.flush()
+        else:
+          # never write a nan row
+          log.error('# R%s rcmd %d: no good readings, target left out',
+                    tr.which, rcmd)
 
-  endtime = str( dt.datetime.now() )
-  print('# Ended on: ', endtime, file=fpo)
+  begtime = str( dt.datetime.now() )
   print('# Began on: ', begtime )
-  print('# Ended on: ', endtime )
-  fpo.close()
+  try:
+    for fpo in fpos:
+      print('# Began on: ', begtime, file=fpo)
+
+    if dual:
+      # one thread per resistor: the serial session interleaves their
+      # module commands, and each waits on its own meter while the
+      # other one is setting resistance or reading
+      with prof.stage('channels'), \
+          ThreadPoolExecutor(max_workers=len(trs)) as pool:
+        jobs = [ pool.submit(check_resistor, tr, dmm, fpo)
+                 for tr, dmm, fpo in zip(trs, dmms, fpos) ]
+        for job in jobs:
+          job.result()
+    else:
+      check_resistor(trs[0], dmms[0], fpos[0])
+
+    endtime = str( dt.datetime.now() )
+    for fpo in fpos:
+      print('# Ended on: ', endtime, file=fpo)
+    print('# Began on: ', begtime )
+    print('# Ended on: ', endtime )
+  finally:
+    # the points measured so far reach the disk even if the run fails
+    for fpo in fpos:
+      fpo.close()
+    prof.stop()
 
 if __name__ == "__main__":
   main(sys.argv)
@@ -2,13 +2,16 @@
 
 import sys
 import csv
+import struct
+import zlib
 
 class Registers:
-  def __init__( self, rnom, ract, rerr, regs ):
+  def __init__( self, rnom, ract, rerr, regs, relay=False ):
     self.rnom = rnom
     self.ract = ract
     self.rerr = rerr
     self.regs = regs
+    self.relay = relay
   def __str__(self):
     return '{s.rnom:.1f}\t'\
            '{s.regs[0]}\t{s.regs[1]}\t{s.regs[2]}\t{s.regs[3]}\t'\
@@ -18,6 +21,26 @@ class Registers:
            '{s.regs[0]}\t{s.regs[1]}\t{s.regs[2]}\t{s.regs[3]}\t'\
            '{s.ract:.3f}\t{s.rerr:+.3f}'.format(s=self)
 
+# Compact binary image of an inverse table, for the module firmware:
+#   header  'TRIV', version, serial, resistor, rbeg, rend, nres, nregs
+#   entry   rnom delta from the previous entry (uint8),
+#           base counts delta from the previous entry (int8),
+#           register offsets from the base (4 x 2 bits, each -1..+1
+#           stored as 0..2, register 1 in the low bits),
+#           ract - rnom and rerr in milliohms (2 x int16)
+#   crc     CRC32 of everything before it
+# The base is register 4: invert() bumps registers 1-3 by at most one
+# count from it, and it moves about one count per ohm, so the quad
+# takes two bytes instead of four.  rnom is delta coded too, it steps
+# by one except from the relay entry (0) to rbeg.  A table with only
+# the relay entry has rbeg and rend stored as 0.
+# All numbers little endian.
+IMAGE_MAGIC = b'TRIV'
+IMAGE_VERSION = 2
+IMAGE_HEADER = struct.Struct('<4sB8s4sHHHH')
+IMAGE_ENTRY = struct.Struct('<BbBhh')
+IMAGE_CRC = struct.Struct('<I')
+
 class Inverse:
   def __init__(self, fname=None):
     self.regs=[]
@@ -73,6 +96,57 @@ class Inverse:
     self.print_header(fp)
     self.print_regs(fp)
 
+  def pack( self ):
+    rbeg = int(self.rbeg) if self.rbeg is not None else 0
+    rend = int(self.rend) if self.rend is not None else 0
+    data = bytearray(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION,
+        self.serno.encode('ascii'), self.resno.encode('ascii'),
+        rbeg, rend, self.nres, len(self.regs)))
+    rprev = 0
+    bprev = 0
+    for reg in self.regs:
+      rnom = int(reg.rnom)
+      if rnom != reg.rnom or not 0 <= rnom-rprev <= 255:
+        raise ValueError(f'cannot pack nominal resistance {reg.rnom}')
+      base = reg.regs[3]
+      offsets = [ r - base for r in reg.regs ]
+      if not -128 <= base-bprev <= 127 or any(abs(o) > 1 for o in offsets):
+        raise ValueError(f'cannot pack registers {reg.regs} at {reg.rnom}')
+      bumps = sum( (o+1) << 2*i for i, o in enumerate(offsets) )
+      data += IMAGE_ENTRY.pack(rnom-rprev, base-bprev, bumps,
+                  round(1000*(reg.ract-rnom)), round(1000*reg.rerr))
+      rprev = rnom
+      bprev = base
+    data += IMAGE_CRC.pack(zlib.crc32(data))
+    return bytes(data)
+
+  def unpack( self, data ):
+    (crc,) = IMAGE_CRC.unpack_from(data, len(data)-IMAGE_CRC.size)
+    if zlib.crc32(data[:-IMAGE_CRC.size]) != crc:
+      raise ValueError('inverse image CRC mismatch')
+    magic, version, serno, resno, rbeg, rend, nres, nregs = \
+        IMAGE_HEADER.unpack_from(data, 0)
+    if magic != IMAGE_MAGIC or version != IMAGE_VERSION:
+      raise ValueError('not an inverse image')
+    # same types as load() gives
+    self.serno = str(serno.rstrip(b'\0'), 'ascii')
+    self.resno = str(resno.rstrip(b'\0'), 'ascii')
+    self.rbeg = float(rbeg) if nres > 1 else None
+    self.rend = float(rend) if nres > 1 else None
+    self.nres = nres
+    self.regs = []
+    rnom = 0
+    base = 0
+    for i in range(nregs):
+      offset = IMAGE_HEADER.size + i*IMAGE_ENTRY.size
+      delta, dbase, bumps, mact, merr = IMAGE_ENTRY.unpack_from(data, offset)
+      rnom += delta
+      base += dbase
+      regs = [ base + ((bumps >> 2*i) & 3) - 1 for i in range(4) ]
+      ract = rnom + mact/1000
+      rerr = merr/1000
+      self.regs.append(Registers(float(rnom), ract, rerr, regs))
+
   def lookup( self, rnom ):
     irnom = int(rnom+0.5)
     if irnom < int(self.rbeg):
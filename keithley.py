@@ -5,8 +5,12 @@ import socket
 #import pyvisa
 import time
 import struct
+import re
+import logging
 from enum import Enum, IntEnum
 
+log = logging.getLogger('keithley')
+
 class K195A:
 
   power_up_command = 'T6F0R6K0Q00S2M0Z0W1A0J0G4B0P2Y\r\nX'
@@ -36,31 +40,257 @@ class K195A:
       current_ac = (20e-6, 200e-6, 2e-3, 20e-3, 200e-3, 2, 2)
       resistance = (20, 200, 2000, 20e3, 200e3, 2e6, 20e6)
 
+  # Readings as sent by the meter, selected by the G command:
+  #   NOHM+0.01198E+3      prefix, no suffix
+  #   +0.01198E+3          no prefix, no suffix
+  #   NOHM+0.01198E+3B007  prefix, data store location suffix
+  # A data store dump is several of these, separated by commas
+  reading_format = re.compile(
+      r'([NO])?([A-Z]{3})?([-+][0-9]*\.?[0-9]+E[-+][0-9]+)(?:B([0-9]+))?')
+
+  # Data store commands used for bulk acquisition
+  buffer_arm_command = 'Q0T4X'    # store every conversion, continuous on X
+  buffer_dump_command = 'B1X'     # readings from data store
+  buffer_done_command = 'B0T0X'   # readings from A/D, continuous on talk
+  conversion_time = 0.100         # seconds per reading, S2 integration
+
+  # parsed status words, by status string
+  status_cache = {}
+
+  # where each setting appears in the status word, after '195 '
+  status_fields = { 'T': (0,1), 'F': (1,2), 'R': (2,3), 'K': (3,4),
+                    'Q': (4,6), 'S': (6,7), 'M': (7,8), 'Z': (8,9),
+                    'W': (9,11), 'A': (11,12), 'J': (12,13), 'G': (13,14),
+                    'B': (14,15), 'P': (15,16) }
+  setting_format = re.compile(r'([A-Z])([0-9]+)')
+
+  # settings for the TraceR resistance measurements, and the
+  # seconds each one needs to settle.  This has to cover every
+  # setting the readings depend on, since the meter is no longer
+  # cleared first: readout from the A/D not the data store (B0), no
+  # data store interval (Q0), relative off (Z0), the power up reading
+  # format (G4), and continuous on talk (T0).
+  ohms_setup = (('B0X', 0.1), ('Q0X', 0.1), ('Z0X', 0.1), ('G4X', 0.1),
+                ('F2X', 3.0), ('R3X', 0.1), ('P2X', 0.1),
+                ('S2X', 0.1), ('T0X', 0.1))
+
   def __init__(self, instrument, interface=None):
     self.dev = instrument
     self.ctl = interface
     self.dev.timeout = 6000
     self.status_word = ''
+    self.status_parsed = None
+    self.shadow = None
 
   def write(self,val):
+    # any command may change the configuration
+    self.status_parsed = None
+    if self.shadow is not None:
+      self.shadow.update(self.settings_in(val))
     return self.dev.write(val)
 
   def read(self):
     return self.dev.read()
 
   def query(self,val):
+    if val not in ('', 'U0DX'):
+      # a command sent with the query changes settings, as in write
+      self.status_parsed = None
+      if self.shadow is not None:
+        self.shadow.update(self.settings_in(val))
     return self.dev.query(val)
 
   def status(self):
     self.status_word = self.dev.query('U0DX')
     return self.status_word
 
+  def settings(self):
+    """
+    Returns the parsed status word, only asking the meter
+    for it again after a command may have changed it.
+    """
+    if self.status_parsed is None:
+      self.status_parsed = self.parse_status_word(self.status().strip())
+    return self.status_parsed
+
+  def setup_ohms(self):
+    """
+    Configures the meter for resistance readings, sending only the
+    settings it does not already have.  The meter is only cleared if
+    its status word cannot be read.
+
+    :return: Number of commands sent
+    :rtype: `int`
+    """
+    try:
+      self.shadow_load()
+    except ValueError:
+      self.clear()
+      time.sleep(0.100)
+      self.shadow_load()
+    return sum( self.configure(command, settle)
+                for command, settle in K195A.ohms_setup )
+
+  def prepare_ohms(self):
+    """
+    Sets up resistance readings as `setup_ohms` does, reports the
+    status word, and waits for the first reading.
+
+    :return: Number of setup commands sent
+    :rtype: `int`
+    """
+    # only the settings the meter does not already have are sent
+    nsent = self.setup_ohms()
+    print('settings sent:', nsent)
+
+    status = self.query('U0DX').strip()
+    print('status:', status)
+    print('Waiting for the Keithley meter...', end='')
+    sys.stdout.flush()
+    reply = self.query('')
+    print(" okay, let's go!")
+    return nsent
+
   def clear(self):
+    # device clear returns the meter to its power up settings
+    self.invalidate()
     self.dev.clear()
     return 'DCL'
 
+  def invalidate(self):
+    """Forgets the shadow settings, call after a reconnect or reset"""
+    self.status_parsed = None
+    self.shadow = None
+
+  def settings_in(self, command):
+    # {letter: value} for the settings a command string changes
+    return { letter: int(value) for letter, value
+             in K195A.setting_format.findall(command)
+             if letter in K195A.status_fields }
+
+  def shadow_load(self):
+    sw = self.status().strip()
+    if not sw.startswith('195 '):
+      raise ValueError(f'bad status word {sw}')
+    fields = sw[4:]
+    self.shadow = { letter: int(fields[beg:end]) for letter, (beg, end)
+                    in K195A.status_fields.items() }
+
+  def configure(self, command, settle=0.1):
+    """
+    Sends command, such as 'F2X', only if it changes a setting the
+    meter does not already have, then waits `settle` seconds.  The
+    current settings are read from the status word once, then
+    tracked as commands are written.
+
+    :return: True if the command was sent
+    :rtype: `bool`
+    """
+    if self.shadow is None:
+      self.shadow_load()
+    wanted = self.settings_in(command)
+    if wanted and all(self.shadow.get(k) == v for k, v in wanted.items()):
+      return False
+    self.write(command)
+    time.sleep(settle)
+    return True
+
   def close(self):
     pass
+
+  def parse_reading(self, reply):
+    """
+    Decodes one reply such as ``NOHM+0.01198E+3``.
+
+    :param reply: Reply string from the meter
+    :type: `str`
+
+    :return: ``(function, value, overflow)``, function is None if
+       the reply had no prefix; None if the reply is malformed
+    :rtype: `tuple`
+    """
+    m = K195A.reading_format.search(reply)
+    if m is None:
+      return None
+    return (m.group(2), float(m.group(3)), m.group(1) == 'O')
+
+  def parse_readings(self, reply):
+    """Decodes all the readings in a reply, see `parse_reading`"""
+    return [ (m.group(2), float(m.group(3)), m.group(1) == 'O')
+             for m in K195A.reading_format.finditer(reply) ]
+
+  def decode(self, reply, function=None):
+    """
+    Returns the good readings in reply as floats, dropping
+    overflows and readings of some other function.
+    """
+    return [ value for func, value, overflow in self.parse_readings(reply)
+             if not overflow and (function is None or func in (None, function)) ]
+
+  def measure(self, npoints, function='OHM', retries=3):
+    """
+    Takes `npoints` good readings one query at a time, giving up
+    after `retries` times as many queries.
+
+    :return: The good readings, possibly fewer than `npoints`
+    :rtype: `list` of `float`
+    """
+    readings = []
+    for _ in range(npoints * retries):
+      readings += self.decode(self.query(''), function)
+      if len(readings) >= npoints: break
+    return readings[:npoints]
+
+  def buffer_arm(self):
+    self.write(K195A.buffer_arm_command)
+
+  def buffer_fetch(self):
+    self.write(K195A.buffer_dump_command)
+    return self.read()
+
+  def buffer_done(self):
+    self.write(K195A.buffer_done_command)
+
+  def acquire(self, npoints, function='OHM', retries=3):
+    """
+    Fills the meter's data store with `npoints` conversions and
+    returns them from one bulk transfer, instead of `npoints`
+    separate queries.
+
+    :param npoints: Number of readings wanted
+    :type: `int`
+
+    :return: Readings in the order they were stored
+    :rtype: `list` of `float`
+    """
+    self.buffer_arm()
+    time.sleep(npoints * K195A.conversion_time)
+    readings = []
+    for _ in range(retries):
+      readings = self.decode(self.buffer_fetch(), function)
+      if len(readings) >= npoints: break
+      # store not filled yet, wait for the remaining conversions
+      time.sleep((npoints-len(readings)) * K195A.conversion_time)
+    self.buffer_done()
+    return readings[-npoints:]
+
+  def take(self, npoints, bulk=False, minimum=1, attempts=3, function='OHM'):
+    """
+    Takes `npoints` readings, with `acquire` if `bulk` or else
+    `measure`, and takes them all again while fewer than `minimum`
+    good readings come back, at most `attempts` times.
+
+    :return: The good readings of the last attempt
+    :rtype: `list` of `float`
+    """
+    for attempt in range(attempts):
+      if bulk:
+        readings = self.acquire(npoints, function)
+      else:
+        readings = self.measure(npoints, function)
+      if len(readings) >= minimum: break
+      log.warning('# Error: %d good readings, measuring again', len(readings))
+    return readings
    
 
   def parse_status_word(self,sw):
@@ -75,6 +305,8 @@ class K195A:
       :return: A parsed version of the status word as a Python dictionary
       :rtype: `dict`
       """
+      if sw in K195A.status_cache:
+          return dict(K195A.status_cache[sw])
       statusword = bytes(sw, 'ascii')
 
       if statusword[:3] != b'195':
@@ -85,7 +317,7 @@ class K195A:
        delay, multiplex, selftest, data_fmt, data_ctrl, filter_mode,
        terminator) = struct.unpack('@4c2s3c2s5c2s', statusword[4:])
 
-      return {'trigger': K195A.TriggerMode(int(trigger)),
+      parsed = {'trigger': K195A.TriggerMode(int(trigger)),
               'mode': K195A.Mode(int(function)),
               'range': int(input_range),
               'eoi': (eoi == b'1'),
@@ -100,14 +332,18 @@ class K195A:
               'datacontrol': data_ctrl,
               'filter': filter_mode,
               'terminator': terminator}
+      K195A.status_cache[sw] = parsed
+      return dict(parsed)
 
 class Remote_device:
 
-  def __init__(self, host, port, verbose=True):
+  def __init__(self, host, port, verbose=True, address=None):
     self.host = host
     self.port = port
     self.verbose = None
     self.sock = None
+    # GPIB address on the bridge, None for the bridge's default
+    self.address = address
     self.connect(host, port)
     self.timeout = 0 #TBD not used now
   
@@ -135,14 +371,22 @@ class Remote_device:
         break
     #s.setblocking(True)
     self.sock.settimeout(11.000)
+    if self.address is not None:
+      self.select(self.address)
 
   def sock_write(self, message):
     self.sock.sendall(message)
 
-  def sock_read(self):
+  def sock_read(self, terminator=None):
+    # a reply can take more than one recv, a data store dump is
+    # well over 1 KB; with a terminator, read until it comes
     buff=b''
     try: 
       buff = self.sock.recv(1024)
+      while terminator and not buff.endswith(terminator):
+        more = self.sock.recv(4096)
+        if not more: break
+        buff += more
     except socket.timeout as e:
       err = e.args[0]
       if err == 'timed out':
@@ -156,7 +400,7 @@ class Remote_device:
   def read(self):
     message = 'R'
     self.sock_write(message.upper().encode())
-    return str( self.sock_read()[2:], 'ascii' )
+    return str( self.sock_read(b'\n')[2:], 'ascii' )
 
   def write(self, command):
     message = 'W'+command
@@ -166,14 +410,25 @@ class Remote_device:
   def query(self, command):
     message = 'Q'+command
     self.sock_write(message.upper().encode())
-    return str( self.sock_read()[2:], 'ascii' )
+    return str( self.sock_read(b'\n')[2:], 'ascii' )
 
   def clear(self):
     message = 'C'
     self.sock_write(message.upper().encode())
     return str( self.sock_read()[2:], 'ascii' )
 
-def get_meter(local=False):
+  def select(self, address):
+    # later requests on this connection go to this GPIB address
+    self.address = address
+    message = 'A'+str(address)
+    self.sock_write(message.upper().encode())
+    return str( self.sock_read()[2:], 'ascii' )
+
+# GPIB address of the meter on each TraceR resistor, for measuring
+# both at once.  One resistor at a time uses the default meter.
+METER_ADDRESS = { '1': 5, '2': 6 }
+
+def get_meter(local=False, address=None):
   instrument = None
   interface = None
   dmm = None
@@ -181,7 +436,7 @@ def get_meter(local=False):
   # directly connected to this computer
   if local:
     rm = pyvisa.ResourceManager()
-    instrument = rm.open_resource('GPIB0::5::INSTR')
+    instrument = rm.open_resource(f'GPIB0::{address or 5}::INSTR')
     interface = rm.open_resource('GPIB0::INTFC')
 
   # Use this method if talking to a GPIB device 
@@ -189,7 +444,7 @@ def get_meter(local=False):
   if not local:
     HOST = '192.168.1.37'  # The server's hostname or IP address
     PORT = 65432        # The port used by the server
-    instrument = Remote_device( HOST, PORT )
+    instrument = Remote_device( HOST, PORT, address=address )
   # open the meter device
   if instrument is not None:
     dmm = K195A(instrument, interface) 
@@ -200,23 +455,9 @@ def meter_test(dmm=None):
   if dmm is None:
     dmm = get_meter()
 
-  dmm.clear()
-  time.sleep(0.100)
-
-  status = dmm.query('U0DX')
-  print('status:', status)
-
-  dmm.write('F2X')
-  time.sleep(3.0)
-
-  dmm.write('R3X')
-  time.sleep(0.1)
-  dmm.write('P2X')
-  time.sleep(0.1)
-  dmm.write('S2X')
-  time.sleep(0.1)
-  dmm.write('T0X')
-  time.sleep(0.1)
+  # only the settings the meter does not already have are sent
+  nsent = dmm.setup_ohms()
+  print('settings sent:', nsent)
 
   status = dmm.query('U0DX')
   print('status:', status)
@@ -225,11 +466,7 @@ def meter_test(dmm=None):
 
   for _ in range(5):
     reply = dmm.query('')
-    prefix = reply[0]
-    mode = reply[1:4]
-    value = reply[4:].strip()
-    ohms = float(value)
-    print(prefix, mode, value, ohms)
+    print(reply.strip(), dmm.parse_reading(reply))
 
 ####  status = dmm.status().strip()
 ####  print('status:', status)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import datetime as dt
+import numpy as np
+
+from calibration import Sample, Calib
+from catalog import began_time
+
+# Merge repeated calibration runs of one resistor into one calibration.
+#
+# Each run gives, per wiper count, a mean, a sample stdev and a count.
+# Runs are folded in one at a time with Chan's parallel update of
+# (n, mean, M2), where M2 = sum of squared deviations, done for all
+# counts at once with numpy:
+#
+#   n     = na + nb
+#   delta = mean_b - mean_a
+#   mean  = mean_a + delta * nb/n
+#   M2    = M2_a + M2_b + delta^2 * na*nb/n
+#
+# Runs are lined up by count over the union of their counts, a count
+# missing from a run (a point that got no readings) simply adds
+# nothing.  Points with no readings carry no weight either; a count
+# that no run measured keeps the plain average of their means.  Raw
+# readings are concatenated, so a merged row lists all its readings.
+# The merged file begins when the earliest of its runs began.
+
+class Run_merger:
+
+  def __init__( self ):
+    self.serno = None
+    self.resno = None
+    # one entry per count any run has, in order, the relay point last
+    self.counts = np.zeros(0, dtype=int)
+    self.n = np.zeros(0)
+    self.mean = np.zeros(0)
+    self.m2 = np.zeros(0)
+    self.nominal = np.zeros(0)    # sum of means, for counts nobody measured
+    self.nnominal = np.zeros(0)   # and the number of runs in it
+    self.nruns = 0
+    self.readings = []
+
+  def align( self, counts ):
+    # grows the merged arrays to the union of their counts and these,
+    # a new count starts out unmeasured; returns where counts are
+    union = np.union1d(self.counts, counts)
+    if len(union) > len(self.counts):
+      old = np.searchsorted(union, self.counts)
+      def grow( a ):
+        grown = np.zeros(len(union), dtype=a.dtype)
+        grown[old] = a
+        return grown
+      self.n, self.mean, self.m2 = grow(self.n), grow(self.mean), grow(self.m2)
+      self.nominal, self.nnominal = grow(self.nominal), grow(self.nnominal)
+      readings = [ [] for _ in union ]
+      for i, r in zip(old, self.readings):
+        readings[i] = r
+      self.counts, self.readings = union, readings
+    return np.searchsorted(self.counts, counts)
+
+  def add( self, calib ):
+    if self.nruns == 0:
+      self.serno, self.resno = calib.serno, calib.resno
+    elif (calib.serno, calib.resno) != (self.serno, self.resno):
+      raise ValueError(f'cannot merge {calib.serno} {calib.resno} '
+                       f'into {self.serno} {self.resno}')
+    counts = np.array([ s.counts for s in calib.samples ], dtype=int)
+    n = np.array([ s.nsamples for s in calib.samples ], dtype=float)
+    mean = np.array([ s.ohms for s in calib.samples ])
+    stdev = np.array([ s.stdev for s in calib.samples ])
+    m2 = np.where(n > 1, stdev**2 * (n-1), 0.0)   # stdev is nan below 2
+    # a run lines up with the others by count, counts it skipped
+    # take nothing from it
+    i = self.align(counts)
+    na = self.n[i]
+    ntot = na + n
+    safe = np.where(ntot > 0, ntot, 1)
+    delta = mean - self.mean[i]
+    self.mean[i] = np.where(ntot > 0, self.mean[i] + delta*n/safe, self.mean[i])
+    self.m2[i] = self.m2[i] + m2 + delta**2 * na*n/safe
+    self.n[i] = ntot
+    self.nominal[i] += mean
+    self.nnominal[i] += 1
+    for j, s in zip(i, calib.samples):
+      self.readings[j] += list(s.samples)
+    self.nruns += 1
+
+  def samples( self ):
+    mean = np.where(self.n > 0, self.mean, self.nominal/np.maximum(self.nnominal, 1))
+    stdev = np.where(self.n > 1, np.sqrt(self.m2 / np.maximum(self.n-1, 1)), np.nan)
+    return [ Sample( int(c), float(m), float(s), int(n), r )
+             for c, m, s, n, r in zip(self.counts, mean, stdev,
+                                      self.n, self.readings) ]
+
+  def calib( self ):
+    # merged calibration, ready for linear_fit() and invert()
+    calib = Calib()
+    calib.serno = self.serno
+    calib.resno = self.resno
+    calib.samples = self.samples()
+    return calib
+
+  def print_rows( self, fp ):
+    for s in self.samples():
+      s.print_row(fp)
+
+def main(argv):
+  descr = 'Merge repeated calibration runs of one TraceR resistor'
+  parser = argparse.ArgumentParser(description=descr)
+  parser.add_argument('-o', '--output', required=True, help='Merged cal file, tracer-snN-rM-cal.dat')
+  parser.add_argument('calfiles', nargs='+', help='Cal data files of the same resistor')
+  args = parser.parse_args(argv[1:])
+
+  merger = Run_merger()
+  began = []
+  for fname in args.calfiles:
+    merger.add( Calib(fname, raw=True) )
+    stamp = began_time(fname)
+    if stamp is not None: began.append(stamp)
+  began = dt.datetime.fromtimestamp(min(began)) if began else dt.datetime.now()
+  with open(args.output, 'w') as fp:
+    print('# Began on: ', began, file=fp)
+    print(f'# Merged {merger.nruns} runs:', ' '.join(args.calfiles), file=fp)
+    merger.print_rows(fp)
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from calibration import Sample, Calib
+from reclog import Record_log
+
+# In-memory calibration pipeline, for programs that already hold the
+# sweep (an acquisition engine, a line controller) and want the fit
+# and the inverse table without writing and re-reading text files.
+#
+#   pipe = Pipeline(outdir='data')
+#   calib = pipe.process('SN42', 'R1', counts, ohms, stdev, nsamples)
+#   calib.slope, calib.offset, calib.inverse.lookup(100) ...
+#   pipe.save(calib)     # optional, returns a Future
+#   pipe.close()
+#
+# The arrays are in the order of a tracer-...-cal.dat file: one entry
+# per wiper count, then the relay shunted point last.
+
+def make_calib( serno, resno, counts, ohms, stdev=None, nsamples=None, readings=None ):
+  """Returns a Calib holding the given sweep, as if loaded from a file"""
+  counts = np.asarray(counts)
+  ohms = np.asarray(ohms, dtype=float)
+  if len(counts) != len(ohms):
+    raise ValueError('counts and ohms differ in length')
+  if stdev is None: stdev = np.zeros(len(ohms))
+  if nsamples is None: nsamples = np.ones(len(ohms), dtype=int)
+  if readings is None: readings = [[]] * len(ohms)
+  calib = Calib()
+  calib.serno = serno.upper()
+  calib.resno = resno.upper()
+  calib.samples = [ Sample( int(c), float(r), float(s), int(n), d )
+                    for c, r, s, n, d in zip(counts, ohms, stdev, nsamples, readings) ]
+  return calib
+
+def process( serno, resno, counts, ohms, stdev=None, nsamples=None, readings=None ):
+  """Fits and inverts a sweep, returns the Calib with its inverse"""
+  calib = make_calib( serno, resno, counts, ohms, stdev, nsamples, readings )
+  calib.linear_fit()
+  calib.invert()
+  return calib
+
+class Pipeline:
+
+  def __init__( self, outdir=None, workers=1 ):
+    self.outdir = outdir
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+
+  def process( self, serno, resno, counts, ohms, stdev=None, nsamples=None, readings=None ):
+    return process( serno, resno, counts, ohms, stdev, nsamples, readings )
+
+  def paths( self, calib ):
+    base = f'{calib.serno.lower()}-{calib.resno.lower()}-cal'
+    outdir = self.outdir or '.'
+    return { 'invert': os.path.join(outdir, f'invert-{base}.dat'),
+             'image': os.path.join(outdir, f'invert-{base}.bin'),
+             'sweep': os.path.join(outdir, f'tracer-{base}.rec') }
+
+  def write( self, calib, invert=True, image=False, sweep=False ):
+    paths = self.paths(calib)
+    written = []
+    if invert:
+      with open(paths['invert'], 'w') as fp:
+        calib.inverse.print_all(fp)
+      written.append(paths['invert'])
+    if image:
+      with open(paths['image'], 'wb') as fp:
+        fp.write(calib.inverse.pack())
+      written.append(paths['image'])
+    if sweep:
+      log = Record_log(paths['sweep'], calib.serno, calib.resno)
+      for s in calib.samples:
+        log.append(s.counts, s.ohms, s.stdev, s.samples)
+      log.close()
+      written.append(paths['sweep'])
+    return written
+
+  def save( self, calib, invert=True, image=False, sweep=False ):
+    """
+    Writes the chosen outputs in the background.  Returns a Future
+    whose result is the list of files written.
+    """
+    return self.executor.submit(self.write, calib, invert, image, sweep)
+
+  def close( self ):
+    # waits for pending saves
+    self.executor.shutdown(wait=True)
+
+  def __enter__( self ):
+    return self
+
+  def __exit__( self, *exc ):
+    self.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import threading
+import cProfile
+import pstats
+from collections import defaultdict
+
+# time.sleep may be wrapped as a stage, the sampler must not be timed
+sleep = time.sleep
+
+# Profiling support for the --profile option of calproc, cal and check.
+#
+# Stages are named spans of the run (load, fit, ... or serial, gpib,
+# settle, io).  Stages may nest, each one is charged only its own time,
+# not the time of the stages inside it.  Anything outside all stages
+# shows up as 'other'.
+#
+# Stages are kept per thread, so the channel threads of a dual run are
+# profiled too.  Each thread gets its own section of the breakdown,
+# with percentages of the wall time; only the main thread has 'other'.
+# The sampled stacks cover all threads, the cProfile data only the
+# main thread.
+#
+# stop() writes three files named after the tool:
+#   <name>.prof       cProfile data, for pstats or snakeviz
+#   <name>.collapsed  sampled stacks in the collapsed format read by
+#                     flamegraph.pl and speedscope
+#   <name>.stages     the stage breakdown, also printed to stderr
+
+class Sampler:
+  """Samples the stacks of all threads every `interval` seconds"""
+
+  def __init__( self, interval=0.001 ):
+    self.interval = interval
+    self.stacks = defaultdict(int)
+    self.running = False
+    self.thread = threading.Thread(target=self.run, daemon=True)
+
+  def start( self ):
+    self.running = True
+    self.thread.start()
+
+  def stop( self ):
+    self.running = False
+    self.thread.join()
+
+  def run( self ):
+    me = threading.get_ident()
+    while self.running:
+      threads = { t.ident: t.name for t in threading.enumerate() }
+      for ident, frame in sys._current_frames().items():
+        if ident == me: continue
+        names = []
+        while frame is not None:
+          code = frame.f_code
+          names.append(f'{code.co_filename.rsplit("/",1)[-1]}:{code.co_name}')
+          frame = frame.f_back
+        if names:
+          names.append(threads.get(ident, str(ident)))
+          self.stacks[';'.join(reversed(names))] += 1
+      sleep(self.interval)
+
+  def write( self, fp ):
+    for stack, count in sorted(self.stacks.items()):
+      print(stack, count, file=fp)
+
+class Profiler:
+
+  def __init__( self, name, enabled=True ):
+    self.name = name
+    self.enabled = enabled
+    # by (thread name, stage)
+    self.totals = defaultdict(float)
+    self.counts = defaultdict(int)
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.profile = None
+    self.sampler = None
+    self.began = None
+    self.wrapped = []     # (obj, name, original or None), for stop()
+
+  def start( self ):
+    if not self.enabled: return
+    self.began = time.perf_counter()
+    self.sampler = Sampler()
+    self.sampler.start()
+    self.profile = cProfile.Profile()
+    self.profile.enable()
+
+  def stop( self ):
+    if not self.enabled: return
+    self.unwrap()
+    self.profile.disable()
+    self.sampler.stop()
+    wall = time.perf_counter() - self.began
+    self.profile.dump_stats(f'{self.name}.prof')
+    with open(f'{self.name}.collapsed', 'w') as fp:
+      self.sampler.write(fp)
+    with open(f'{self.name}.stages', 'w') as fp:
+      self.report(wall, fp)
+    self.report(wall, sys.stderr)
+    pstats.Stats(self.profile, stream=sys.stderr)\
+          .sort_stats('cumulative').print_stats(15)
+
+  def report( self, wall, fp ):
+    main = threading.main_thread().name
+    threads = [main] + sorted({ t for t, _ in self.totals if t != main })
+    for thread in threads:
+      rows = [ (stage, secs) for (t, stage), secs in self.totals.items()
+               if t == thread ]
+      if thread == main:
+        print(f'# {self.name} stage\tcalls\tseconds\tpercent', file=fp)
+        rows.append(('other', wall - sum(secs for _, secs in rows)))
+      else:
+        print(f'# {thread} stage\tcalls\tseconds\tpercent', file=fp)
+      for stage, secs in rows:
+        print(f'{stage}\t{self.counts.get((thread, stage), "")}\t'
+              f'{secs:.3f}\t{100*secs/wall:.1f}', file=fp)
+    print(f'total\t\t{wall:.3f}\t100.0', file=fp)
+
+  def enter( self, name ):
+    if not hasattr(self.local, 'stack'): self.local.stack = []
+    self.local.stack.append([name, time.perf_counter(), 0.0])
+
+  def leave( self ):
+    stack = self.local.stack
+    name, start, inner = stack.pop()
+    elapsed = time.perf_counter() - start
+    key = (threading.current_thread().name, name)
+    with self.lock:
+      self.totals[key] += elapsed - inner
+      self.counts[key] += 1
+    if stack:
+      stack[-1][2] += elapsed
+
+  def wrap( self, obj, names, stage ):
+    """Replaces the named functions of obj by timed versions"""
+    if not self.enabled: return
+    for name in names:
+      # methods found through the class are put back by deleting
+      own = vars(obj).get(name) if hasattr(obj, '__dict__') else None
+      self.wrapped.append((obj, name, own))
+      setattr(obj, name, self.timed(getattr(obj, name), stage))
+
+  def unwrap( self ):
+    """Puts back everything wrap replaced, such as time.sleep"""
+    for obj, name, own in reversed(self.wrapped):
+      if own is None:
+        delattr(obj, name)
+      else:
+        setattr(obj, name, own)
+    self.wrapped = []
+
+  def stage( self, name ):
+    """Context manager timing the enclosed block as stage `name`"""
+    return Stage(self, name)
+
+  def timed( self, func, name ):
+    """Returns func wrapped to time each call as stage `name`"""
+    if not self.enabled: return func
+    def wrapper( *args, **kwargs ):
+      self.enter(name)
+      try:
+        return func(*args, **kwargs)
+      finally:
+        self.leave()
+    return wrapper
+
+class Stage:
+
+  def __init__( self, profiler, name ):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__( self ):
+    if self.profiler.enabled: self.profiler.enter(self.name)
+    return self
+
+  def __exit__( self, *exc ):
+    if self.profiler.enabled: self.profiler.leave()
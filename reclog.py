@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import ast
+import mmap
+import struct
+import datetime as dt
+import numpy as np
+
+# Append-only binary record log for sweep data, an alternative to the
+# tab separated tracer-snN-rM-cal.dat text files.
+#
+#   header   magic 'TRCL', version, serial, resistor, began (epoch secs)
+#   record   counts, n, mean, stdev, then n float32 raw readings
+#   ...      one record per point, appended as measured
+#   index    uint32 file offset of each record
+#   trailer  ended (epoch secs), number of records, index offset, 'TRCE'
+#
+# The index and trailer are written by close().  A log that was never
+# closed (the run was interrupted) is still readable, its index is
+# rebuilt by walking the records.  All numbers are little endian.
+
+MAGIC = b'TRCL'
+TRAILER_MAGIC = b'TRCE'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHH8s4sd')
+RECORD = struct.Struct('<hHdd')
+TRAILER = struct.Struct('<dIQ4s')
+
+class Record_log:
+  """Writes a record log, one append() per point"""
+
+  def __init__( self, fname, serno, resno, began=None ):
+    if began is None: began = dt.datetime.now().timestamp()
+    self.fp = open(fname, 'wb')
+    self.offsets = []
+    self.fp.write(HEADER.pack(MAGIC, VERSION, 0,
+                  serno.encode('ascii'), resno.encode('ascii'), began))
+
+  def append( self, counts, mean, stdev, readings ):
+    self.offsets.append(self.fp.tell())
+    readings = np.asarray(readings, dtype='<f4')
+    self.fp.write(RECORD.pack(counts, len(readings), mean, stdev))
+    self.fp.write(readings.tobytes())
+
+  def flush( self ):
+    self.fp.flush()
+
+  def close( self, ended=None ):
+    if ended is None: ended = dt.datetime.now().timestamp()
+    index_offset = self.fp.tell()
+    self.fp.write(np.asarray(self.offsets, dtype='<u4').tobytes())
+    self.fp.write(TRAILER.pack(ended, len(self.offsets),
+                               index_offset, TRAILER_MAGIC))
+    self.fp.close()
+
+class Record_reader:
+  """Random access to the records of a log, readings are not copied"""
+
+  def __init__( self, fname ):
+    with open(fname, 'rb') as fin:
+      self.mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, _, serno, resno, self.began = HEADER.unpack_from(self.mm, 0)
+    if magic != MAGIC:
+      raise ValueError(f'{fname} is not a record log')
+    if version != VERSION:
+      raise ValueError(f'{fname} has unknown version {version}')
+    self.serno = str(serno.rstrip(b'\0'), 'ascii')
+    self.resno = str(resno.rstrip(b'\0'), 'ascii')
+    self.ended = None
+    tail = len(self.mm) - TRAILER.size
+    if tail >= HEADER.size \
+        and self.mm[tail+TRAILER.size-4:] == TRAILER_MAGIC:
+      self.ended, nrec, index_offset, _ = TRAILER.unpack_from(self.mm, tail)
+      self.offsets = np.frombuffer(self.mm, dtype='<u4',
+                                   count=nrec, offset=index_offset)
+    else:
+      self.offsets = self.scan()
+
+  def scan( self ):
+    # no index, the log was not closed: walk the records
+    offsets = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(self.mm):
+      n = RECORD.unpack_from(self.mm, offset)[1]
+      end = offset + RECORD.size + 4*n
+      if end > len(self.mm): break   # partly written last record
+      offsets.append(offset)
+      offset = end
+    return np.array(offsets, dtype='<u4')
+
+  def __len__( self ):
+    return len(self.offsets)
+
+  def __getitem__( self, i ):
+    """Returns (counts, mean, stdev, readings) of record i"""
+    offset = int(self.offsets[i])
+    counts, n, mean, stdev = RECORD.unpack_from(self.mm, offset)
+    readings = np.frombuffer(self.mm, dtype='<f4', count=n,
+                             offset=offset+RECORD.size)
+    return counts, mean, stdev, readings
+
+  def __iter__( self ):
+    for i in range(len(self)):
+      yield self[i]
+
+def parse_stamp( line ):
+  # '# Began on:  2021-07-06 23:45:14.775913'
+  return dt.datetime.fromisoformat(line.split(':', 1)[1].strip()).timestamp()
+
+def format_stamp( stamp ):
+  return dt.datetime.fromtimestamp(stamp)
+
+def dat_to_log( datfile, logfile ):
+  # serial and resistor from the name, as Calib.fname_parse does
+  fields = os.path.basename(datfile).split('-')
+  serno, resno = fields[1].upper(), fields[2].upper()
+  began, ended = None, None
+  rows = []
+  with open(datfile, 'r') as fin:
+    for line in fin:
+      if line.startswith('# Began on:'): began = parse_stamp(line)
+      elif line.startswith('# Ended on:'): ended = parse_stamp(line)
+      elif line.startswith('#') or not line.strip(): continue
+      else: rows.append(line.rstrip('\n').split('\t'))
+  log = Record_log(logfile, serno, resno, began or 0.0)
+  for row in rows:
+    readings = ast.literal_eval(row[4]) if len(row) > 4 else []
+    log.append(int(row[0]), float(row[1]), float(row[2]), readings)
+  log.close(ended or 0.0)
+
+def log_to_dat( logfile, datfile ):
+  # calibration imports this module, so import Sample only here
+  from calibration import Sample
+  log = Record_reader(logfile)
+  with open(datfile, 'w') as fpo:
+    print('# Began on: ', format_stamp(log.began), file=fpo)
+    for counts, mean, stdev, readings in log:
+      Sample( counts, mean, stdev, len(readings), readings ).print_row(fpo)
+    if log.ended is not None:
+      print('# Ended on: ', format_stamp(log.ended), file=fpo)
+
+def main(argv):
+  if len(argv) != 3:
+    print('Usage: reclog <infile> <outfile>')
+    print('  converts tracer-...-cal.dat text to a .rec record log, or back')
+    exit(0)
+  if argv[1].endswith('.rec'):
+    log_to_dat(argv[1], argv[2])
+  else:
+    dat_to_log(argv[1], argv[2])
+
+if __name__ == "__main__":
+  main(sys.argv)
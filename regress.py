@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+
+from inverse import Inverse
+from calibration import Calib
+
+# Regression gate for the Calib -> Inverse pipeline.
+#
+# Equivalence: every data/tracer-snN-rM-cal.dat is loaded, fitted and
+# inverted again, and the table is compared with the shipped golden
+# data/invert-snN-rM-cal.dat.  Header values and registers must match
+# exactly, ract and rerr to within --tol (the files keep 3 decimals).
+# Inverse.lookup must also give the same registers on both tables.
+#
+# Performance: each stage (load, fit, invert, lookup) is timed over all
+# the files, best of --repeat runs, and compared with the throughput
+# stored in the baseline file.  A stage slower than its baseline by
+# more than --threshold fails the gate.  Baselines are per machine,
+# make one with --save-baseline before changing anything; without a
+# baseline the gate fails, unless --no-timing skips the timings.
+#
+# Exit status is 0 when everything passed, 1 otherwise.
+
+BASELINE_FILE = 'regress-baseline.json'
+STAGES = ('load', 'fit', 'invert', 'lookup')
+LOOKUPS = [ 0.5*i for i in range(0, 601) ]    # 0 to 300 ohms
+
+def golden_name( fname ):
+  dirname, base = os.path.split(fname)
+  return os.path.join(dirname, 'invert'+base[len('tracer'):])
+
+def compare( golden, inverse, tol ):
+  """Returns a list of differences between two inverse tables"""
+  diffs = []
+  for key in ('serno', 'resno', 'rbeg', 'rend', 'nres'):
+    a, b = getattr(golden, key), getattr(inverse, key)
+    if a != b:
+      diffs.append(f'{key}: {a} != {b}')
+  if len(golden.regs) != len(inverse.regs):
+    diffs.append(f'entries: {len(golden.regs)} != {len(inverse.regs)}')
+    return diffs
+  for g, r in zip(golden.regs, inverse.regs):
+    if g.rnom != r.rnom or list(g.regs) != list(r.regs):
+      diffs.append(f'rnom {g.rnom}: {g} != {r}')
+    elif abs(g.ract - r.ract) > tol or abs(g.rerr - r.rerr) > tol:
+      diffs.append(f'rnom {g.rnom}: ract/rerr {g.ract:.3f}/{g.rerr:+.3f} '
+                   f'!= {r.ract:.3f}/{r.rerr:+.3f}')
+  for rnom in LOOKUPS:
+    g, r = golden.lookup(rnom), inverse.lookup(rnom)
+    if (g is None) != (r is None) or \
+        (g is not None and list(g.regs) != list(r.regs)):
+      diffs.append(f'lookup {rnom}: {g} != {r}')
+  return diffs
+
+def equivalence( fnames, tol, verbose=False ):
+  """Returns the number of files whose table differs from its golden"""
+  nfail = 0
+  for fname in fnames:
+    calib = Calib( fname )
+    calib.linear_fit()
+    calib.invert()
+    golden = Inverse( golden_name(fname) )
+    diffs = compare( golden, calib.inverse, tol )
+    print(f'{"FAIL" if diffs else "ok"}\t{fname}')
+    for diff in diffs if verbose else diffs[:5]:
+      print(f'\t{diff}')
+    if diffs: nfail += 1
+  return nfail
+
+def timings( fnames, repeat ):
+  """Returns the throughput of each stage, files per second"""
+  best = { stage: float('inf') for stage in STAGES }
+  for _ in range(repeat):
+    elapsed = dict.fromkeys(STAGES, 0.0)
+    for fname in fnames:
+      t0 = time.perf_counter()
+      calib = Calib( fname )
+      t1 = time.perf_counter()
+      calib.linear_fit()
+      t2 = time.perf_counter()
+      calib.invert()
+      t3 = time.perf_counter()
+      for rnom in LOOKUPS:
+        calib.inverse.lookup(rnom)
+      t4 = time.perf_counter()
+      elapsed['load'] += t1 - t0
+      elapsed['fit'] += t2 - t1
+      elapsed['invert'] += t3 - t2
+      elapsed['lookup'] += t4 - t3
+    for stage in STAGES:
+      best[stage] = min(best[stage], elapsed[stage])
+  return { stage: len(fnames)/secs for stage, secs in best.items() }
+
+def performance( rates, baseline, threshold ):
+  """Returns the number of stages slower than the baseline allows"""
+  nfail = 0
+  print(f'# stage\tfiles/s\tbaseline\tratio')
+  for stage, rate in rates.items():
+    base = baseline.get(stage)
+    if base is None:
+      print(f'{stage}\t{rate:.1f}\t-\t-')
+      continue
+    ratio = rate / base
+    slow = ratio < 1.0 - threshold
+    mark = '\tFAIL' if slow else ''
+    print(f'{stage}\t{rate:.1f}\t{base:.1f}\t{ratio:.2f}{mark}')
+    if slow: nfail += 1
+  return nfail
+
+def main(argv):
+  descr = 'Check the Calib/Inverse pipeline against golden outputs and a timing baseline'
+  parser = argparse.ArgumentParser(description=descr)
+  parser.add_argument('--data', default='data', help='Directory of tracer and golden invert files')
+  parser.add_argument('--tol', type=float, default=0.0005, help='Tolerance of ract and rerr, ohms')
+  parser.add_argument('--baseline', default=BASELINE_FILE, help='Timing baseline file')
+  parser.add_argument('--threshold', type=float, default=0.25, help='Allowed throughput loss, fraction')
+  parser.add_argument('--repeat', type=int, default=5, help='Timing runs, the best is kept')
+  parser.add_argument('--save-baseline', action='store_true', help='Store the measured timings as the baseline')
+  parser.add_argument('--no-timing', action='store_true', help='Only check the outputs')
+  parser.add_argument('--verbose', '-v', action='store_true', help='Print all differences')
+  args = parser.parse_args(argv[1:])
+
+  fnames = sorted( f for f in glob.glob(os.path.join(args.data, 'tracer-*-cal.dat'))
+                   if os.path.exists(golden_name(f)) )
+  if not fnames:
+    print('No tracer files with golden outputs in', args.data)
+    sys.exit(1)
+
+  nfail = equivalence( fnames, args.tol, args.verbose )
+
+  if not args.no_timing:
+    rates = timings( fnames, args.repeat )
+    if args.save_baseline:
+      with open(args.baseline, 'w') as fp:
+        json.dump(rates, fp, indent=1)
+      print('Saved baseline:', args.baseline)
+    try:
+      with open(args.baseline, 'r') as fp:
+        baseline = json.load(fp)
+    except OSError:
+      baseline = {}
+      print('No baseline, make one with --save-baseline:', args.baseline)
+      nfail += 1
+    nfail += performance( rates, baseline, args.threshold )
+
+  print('PASS' if nfail == 0 else 'FAIL')
+  sys.exit(0 if nfail == 0 else 1)
+
+if __name__ == "__main__":
+  main(sys.argv)
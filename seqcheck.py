@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import math
+import random
+
+from calibration import Sample
+
+# Sampled calibration check.  Rather than commanding every resistance,
+# draw targets at random from evenly spaced strata of the module's
+# range (so every part of the range is visited early), and after each
+# one update Wald's sequential probability ratio test:
+#
+#   H0: the fraction of targets off by more than `tol` is at most p0
+#   H1: the fraction is at least p1
+#
+# The check stops as soon as either hypothesis is accepted with the
+# requested error rates, alpha (failing a good module) and beta
+# (passing a bad one).  With the defaults a good module passes after
+# about 21 targets, and a couple of bad targets fail it.
+
+class Sequential_check:
+  PASS = 'PASS'
+  FAIL = 'FAIL'
+  UNDECIDED = 'UNDECIDED'
+
+  def __init__( self, measure, lo, hi, tol=1.0, p0=0.02, p1=0.15,
+                alpha=0.05, beta=0.05, nstrata=10, seed=None ):
+    self.measure = measure    # function of target ohms, returns readings
+    self.lo = lo
+    self.hi = hi
+    self.tol = tol
+    self.nstrata = nstrata
+    self.rng = random.Random(seed)
+    self.step_fail = math.log(p1/p0)
+    self.step_pass = math.log((1-p1)/(1-p0))
+    self.accept = math.log(beta/(1-alpha))
+    self.reject = math.log((1-beta)/alpha)
+    self.llr = 0.0
+    self.results = []
+    self.nfail = 0
+    self.nskipped = 0         # targets without a good reading
+    self.decision = Sequential_check.UNDECIDED
+
+  def targets( self ):
+    # one random target from each stratum in turn, without replacement
+    span = self.hi - self.lo + 1
+    strata = []
+    for i in range(self.nstrata):
+      beg = self.lo + (i*span) // self.nstrata
+      end = self.lo + ((i+1)*span) // self.nstrata
+      stratum = list(range(beg, end))
+      self.rng.shuffle(stratum)
+      strata.append(stratum)
+    while any(strata):
+      for stratum in strata:
+        if stratum: yield stratum.pop()
+
+  def run( self ):
+    for rcmd in self.targets():
+      sample = Sample.from_readings( rcmd, self.measure(rcmd) )
+      if sample.nsamples == 0:
+        # nothing to judge, and no nan row for print_rows
+        self.nskipped += 1
+        continue
+      self.results.append(sample)
+      if abs(sample.ohms - rcmd) <= self.tol:
+        self.llr += self.step_pass
+      else:
+        self.nfail += 1
+        self.llr += self.step_fail
+      if self.llr <= self.accept:
+        self.decision = Sequential_check.PASS
+        break
+      if self.llr >= self.reject:
+        self.decision = Sequential_check.FAIL
+        break
+    return self.decision
+
+  def print_rows( self, fp ):
+    # same format as the exhaustive check, in commanded order
+    for s in sorted(self.results, key=lambda s: s.counts):
+      s.print_row(fp)
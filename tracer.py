@@ -1,8 +1,76 @@
 #!/usr/bin/env python3
 import serial
-from time import sleep
+import queue
+import threading
+from concurrent.futures import Future
+from time import sleep, monotonic
 from datetime import datetime, timedelta
 
+class Serial_session:
+  """
+  Owns one serial port shared by several Tracer channels.  Commands
+  from any thread are queued, and a single worker thread writes each
+  one and reads its reply up to the '> ' prompt before starting the
+  next, so replies can never be interleaved.  Keeps queue depth and
+  latency figures, see stats().
+  """
+  PROMPT = b'> '
+
+  def __init__(self, ser, timeout=1.0):
+    self.ser = ser
+    self.timeout = timeout
+    self.requests = queue.Queue()
+    self.lock = threading.Lock()
+    self.count = 0
+    self.max_depth = 0
+    self.wait = 0.0
+    self.service = 0.0
+    self.worst = 0.0
+    self.worker = threading.Thread(target=self.run, daemon=True)
+    self.worker.start()
+
+  def request(self, cmd_string):
+    """Sends cmd_string, returns (bytes written, reply)"""
+    done = Future()
+    self.requests.put((cmd_string, done, monotonic()))
+    with self.lock:
+      self.max_depth = max(self.max_depth, self.requests.qsize())
+    return done.result()
+
+  def transact(self, cmd_string):
+    nwrite = self.ser.write( bytes(cmd_string.encode('ascii')) )
+    buff = b''
+    deadline = monotonic() + self.timeout
+    while not buff.endswith(Serial_session.PROMPT):
+      if monotonic() > deadline: break
+      buff += self.ser.read(max(1, self.ser.in_waiting))
+    return nwrite, str(buff.decode('ascii'))
+
+  def run(self):
+    while True:
+      cmd_string, done, queued = self.requests.get()
+      start = monotonic()
+      try:
+        done.set_result(self.transact(cmd_string))
+      except Exception as e:
+        done.set_exception(e)
+      finish = monotonic()
+      with self.lock:
+        self.count += 1
+        self.wait += start - queued
+        self.service += finish - start
+        self.worst = max(self.worst, finish - queued)
+
+  def stats(self):
+    with self.lock:
+      n = max(self.count, 1)
+      return { 'count': self.count,
+               'depth': self.requests.qsize(),
+               'max_depth': self.max_depth,
+               'wait_ms': 1000*self.wait/n,
+               'service_ms': 1000*self.service/n,
+               'worst_ms': 1000*self.worst }
+
 class Tracer:
   TR1 = '1'
   TR2 = '2'
@@ -15,6 +83,12 @@ class Tracer:
   END = '\n'
   ser = None
   port = None
+  session = None
+  # relay states as reported by the module, in command values
+  RELAY_STATES = { 'open': 0, 'closed': 1, '0': 0, '1': 1 }
+  # bumped whenever the module may have lost its state (reboot,
+  # reconnect), which invalidates every channel's shadow state
+  epoch = 0
 
   @classmethod
   def init_serial(cls,port):
@@ -28,10 +102,13 @@ class Tracer:
                      timeout = 0.250,
                      rtscts = False,
                      dsrdtr = False )
+      cls.session = Serial_session(cls.ser)
+      cls.epoch += 1
 
   @classmethod
   def init_comm_link(cls):
     """Sends ctrl-C and ctrl-D to soft reboot"""
+    cls.epoch += 1
     cls.ser.reset_input_buffer()
     cls.ser.write(b'\x03')
     sleep(1.0)
@@ -60,6 +137,9 @@ class Tracer:
     self.relay=0
     self.ohms=0
     self.ident=''
+    # counts and relay the module is known to hold, from its replies
+    self.shadow = {}
+    self.shadow_epoch = Tracer.epoch
 
   def __repr__(self):
     return f'{self.which}: {self.counts}.{self.relay} = {self.ohms}'
@@ -76,6 +156,8 @@ class Tracer:
       key,val = f.split('=')
       param=key[0]
       if len(key) > 1: which=key[1]
+      # fields for the other channel are not ours
+      if len(key) > 1 and which != self.which: continue
       #print('broken:', key, param, which, val)
       #print('which compare:', which, self.which)
       #print('param:', param)
@@ -83,9 +165,14 @@ class Tracer:
       if param == Tracer.COUNTS:
         #print('param matched counts')
         self.counts = int(val)
+        self.shadow[Tracer.COUNTS] = self.counts
       elif param == Tracer.RELAYS:
         #print('param matched relays')
         self.relay = val
+        if val in Tracer.RELAY_STATES:
+          self.shadow[Tracer.RELAYS] = Tracer.RELAY_STATES[val]
+        else:
+          self.shadow.pop(Tracer.RELAYS, None)
       elif param == Tracer.OHMS:
         #print('param matched ohms')
         self.ohms = float(val)
@@ -96,7 +183,23 @@ class Tracer:
         pass
 
 
+  def invalidate(self):
+    """Forgets the shadow state, the next commands are all sent"""
+    self.shadow = {}
+    self.shadow_epoch = Tracer.epoch
+
   def command(self, param, value=None):
+    if self.shadow_epoch != Tracer.epoch:
+      self.invalidate()
+    # skip settings the module already holds
+    if value is not None and param in (Tracer.COUNTS, Tracer.RELAYS) \
+        and self.shadow.get(param) == int(value):
+      return
+    if value is not None and param == Tracer.OHMS:
+      # the module picks counts and relays for the resistance itself,
+      # trust only what the reply reports back
+      self.shadow.pop(Tracer.COUNTS, None)
+      self.shadow.pop(Tracer.RELAYS, None)
     if param == self.IDENT:
       cmd_string = param + self.END
     else:
@@ -106,11 +209,12 @@ class Tracer:
       else:
         cmd_string += Tracer.ASSIGN + str(value) + self.END
 
-    nwrite = self.ser.write( bytes(cmd_string.encode('ascii')) )
+    # the session serializes commands from all channels and threads
+    nwrite, reply = Tracer.session.request(cmd_string)
     #print('command:')
     #print(cmd_string.strip())
     #print('end-of-command:')
-    reply = str(Tracer.ser.read(1024).decode('ascii'))[nwrite:]
+    reply = reply[nwrite:]
     #print('reply:')
     #print(reply.strip())
     #print('end-of-reply:')
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import sys
+import io
+import time
+import argparse
+import binascii
+
+from tracer import Tracer
+from inverse import Inverse
+
+# Bulk transfer of inverse tables to the TraceR module, through the
+# MicroPython raw REPL that is reachable after a ctrl-C (before the
+# ctrl-D soft reboot into the command interpreter, which then loads
+# the new tables).
+#
+# The table is sent in base64 chunks.  The module checks each chunk's
+# CRC32 before appending it to the file, so a corrupted chunk is simply
+# resent.  An interrupted upload resumes after the last good byte.
+
+class Uploader:
+  CHUNK = 384    # raw bytes per chunk, 512 base64 characters
+  RETRIES = 3
+  TIMEOUT = 5.0  # seconds to wait for a raw REPL reply
+
+  def __init__(self, ser, verbose=False):
+    self.ser = ser
+    self.verbose = verbose
+    self.rxbuf = b''
+
+  def read_until(self, ending, timeout=None):
+    """Returns received bytes up to and including ending"""
+    if timeout is None: timeout = Uploader.TIMEOUT
+    deadline = time.monotonic() + timeout
+    while ending not in self.rxbuf:
+      if time.monotonic() > deadline:
+        raise TimeoutError(f'expected {ending}, got {self.rxbuf}')
+      self.rxbuf += self.ser.read(max(1, self.ser.in_waiting))
+    n = self.rxbuf.index(ending) + len(ending)
+    buff, self.rxbuf = self.rxbuf[:n], self.rxbuf[n:]
+    return buff
+
+  def enter_raw(self):
+    self.ser.write(b'\r\x03\x03')
+    time.sleep(0.2)
+    self.ser.reset_input_buffer()
+    self.rxbuf = b''
+    self.ser.write(b'\x01')
+    self.read_until(b'raw REPL; CTRL-B to exit\r\n>')
+    self.execute('from ubinascii import a2b_base64, crc32\nimport os')
+
+  def exit_raw(self):
+    self.ser.write(b'\x02')
+
+  def execute(self, code):
+    """Runs code in the raw REPL and returns what it printed"""
+    self.ser.write(code.encode('ascii'))
+    self.ser.write(b'\x04')
+    self.read_until(b'OK')
+    out = self.read_until(b'\x04')[:-1]
+    err = self.read_until(b'\x04>')[:-2]
+    if err:
+      raise RuntimeError(str(err, 'ascii').strip())
+    return str(out, 'ascii').strip()
+
+  def remote_size(self, dest):
+    reply = self.execute(f'try:\n print(os.stat({dest!r})[6])\n'
+                         f'except OSError:\n print(-1)')
+    return int(reply)
+
+  def remote_crc(self, dest):
+    reply = self.execute(f'c=0\nf=open({dest!r},"rb")\n'
+                         f'while True:\n b=f.read(512)\n'
+                         f' if not b: break\n c=crc32(b,c)\n'
+                         f'f.close()\nprint(c)')
+    return int(reply)
+
+  def send_chunk(self, dest, chunk):
+    crc = binascii.crc32(chunk)
+    b64 = str(binascii.b2a_base64(chunk, newline=False), 'ascii')
+    code = f'd=a2b_base64({b64!r})\nc=crc32(d)\n'\
+           f'if c=={crc}:\n f=open({dest!r},"ab")\n f.write(d)\n f.close()\n'\
+           f'print(c)'
+    for _ in range(Uploader.RETRIES):
+      if int(self.execute(code)) == crc:
+        return
+    raise RuntimeError(f'chunk failed checksum {Uploader.RETRIES} times')
+
+  def upload(self, data, dest, resume=True):
+    """
+    Writes data to file dest on the module, then reads back
+    its CRC32 to verify it.  Returns (bytes sent, seconds).
+    """
+    start = time.perf_counter()
+    offset = 0
+    if resume:
+      size = self.remote_size(dest)
+      if 0 < size <= len(data) \
+          and self.remote_crc(dest) == binascii.crc32(data[:size]):
+        offset = size
+    if offset == 0:
+      self.execute(f'open({dest!r},"wb").close()')
+    elif self.verbose:
+      print(f'resuming {dest} at byte {offset}')
+    nsent = len(data) - offset
+    while offset < len(data):
+      chunk = data[offset:offset+Uploader.CHUNK]
+      self.send_chunk(dest, chunk)
+      offset += len(chunk)
+      if self.verbose:
+        print(f'{dest}: {offset}/{len(data)}', end='\r')
+    if self.verbose: print()
+    if self.remote_crc(dest) != binascii.crc32(data):
+      raise RuntimeError(f'verify failed for {dest}')
+    return nsent, time.perf_counter() - start
+
+def table_bytes(inverse):
+  fp = io.StringIO()
+  inverse.print_all(fp)
+  return fp.getvalue().encode('ascii')
+
+def main(argv):
+  descr = 'Upload inverse function tables to a TraceR module'
+  parser = argparse.ArgumentParser(description=descr)
+  parser.add_argument('--port', default='/dev/ttyACM0', help='Module serial port')
+  parser.add_argument('--restart', action='store_true', help='Start over instead of resuming')
+  parser.add_argument('--binary', action='store_true', help='Send the compact binary image instead of the text table')
+  parser.add_argument('--verbose', action='store_true', help='Show transfer progress')
+  parser.add_argument('invfiles', nargs='+', help='Inverse function file(s), invert-snN-rM-cal.dat')
+  args = parser.parse_args(argv[1:])
+
+  Tracer.init_serial(args.port)
+  up = Uploader(Tracer.ser, args.verbose)
+  up.enter_raw()
+  try:
+    for fname in args.invfiles:
+      inverse = Inverse(fname)
+      if args.binary:
+        dest = f'invert-{inverse.resno.lower()}.bin'
+        data = inverse.pack()
+      else:
+        dest = f'invert-{inverse.resno.lower()}.dat'
+        data = table_bytes(inverse)
+      nsent, secs = up.upload(data, dest, not args.restart)
+      print(f'{fname} -> {dest}: {nsent} bytes in {secs:.2f} s, '
+            f'{nsent/secs:.0f} bytes/s')
+  finally:
+    up.exit_raw()
+
+  # soft reboot so the module loads the new tables
+  if not Tracer.init_comm_link():
+    print('failed to restart TraceR module')
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+import time
+import json
+import fnmatch
+
+from calibration import Calib
+
+# Incremental build of calproc outputs for a data directory:
+#
+#   tracer-snN-rM-cal.dat (or .rec)  ->  invert-snN-rM-cal.dat
+#                                    ->  its row of cal-stats.dat
+#                                    ->  plot-snN-rM.png (optional)
+#
+# Each input's size and mtime are kept in a state file in the data
+# directory, and only inputs whose signature changed, or whose outputs
+# are missing, are processed again.  Stats rows are kept in the state
+# too, so cal-stats.dat is rewritten without reloading anything.
+
+STATE_FILE = '.calproc-state.json'
+STATS_FILE = 'cal-stats.dat'
+INPUTS = ('tracer-*-cal.dat', 'tracer-*-cal.rec')
+
+class Builder:
+
+  def __init__( self, datadir, plots=False, settle=0.0, verbose=True ):
+    self.datadir = datadir
+    self.plots = plots
+    self.settle = settle      # skip inputs modified less than this long ago
+    self.verbose = verbose
+    self.state_path = os.path.join(datadir, STATE_FILE)
+    self.state = self.load_state()
+
+  def load_state( self ):
+    try:
+      with open(self.state_path, 'r') as fin:
+        return json.load(fin)
+    except (OSError, ValueError):
+      return {}
+
+  def save_state( self ):
+    # write then rename, so a crash never leaves a half written state
+    tmp = self.state_path + '.tmp'
+    with open(tmp, 'w') as fout:
+      json.dump(self.state, fout, indent=1, sort_keys=True)
+    os.replace(tmp, self.state_path)
+
+  def scan( self ):
+    # one directory listing, stat info comes with it
+    inputs = {}
+    with os.scandir(self.datadir) as it:
+      for entry in it:
+        if any(fnmatch.fnmatch(entry.name, p) for p in INPUTS):
+          st = entry.stat()
+          inputs[entry.name] = [st.st_mtime_ns, st.st_size]
+    return inputs
+
+  def outputs( self, name ):
+    base = name.rsplit('.', 1)[0]
+    outs = [ os.path.join(self.datadir, 'invert'+base[len('tracer'):]+'.dat') ]
+    if self.plots:
+      outs.append(os.path.join(self.datadir, 'plot'+base[len('tracer'):-len('-cal')]+'.png'))
+    return outs
+
+  def build_one( self, name ):
+    calib = Calib( os.path.join(self.datadir, name) )
+    calib.linear_fit()
+    calib.invert()
+    outs = self.outputs(name)
+    with open(outs[0], 'w') as fp:
+      calib.inverse.print_all(fp)
+    if self.plots:
+      import calplot
+      calplot.save_page( calib, outs[1] )
+    return f'{calib.serno}\t{calib.resno}\t'\
+           f'{calib.slope:.3f}\t{calib.offset:.3f}\t'\
+           f'{calib.inverse.rbeg}\t{calib.inverse.rend}\t{calib.inverse.nres}'
+
+  def write_stats( self ):
+    with open(os.path.join(self.datadir, STATS_FILE), 'w') as fp:
+      print( f'# TraceR calibration summary', file=fp)
+      print( f'# S/N\tR#\tSlope\tOffset\tRmin\tRmax\tNres', file=fp)
+      for name in sorted(self.state):
+        print(self.state[name]['stats'], file=fp)
+
+  def build( self ):
+    """One pass, returns the names of the inputs that were rebuilt"""
+    inputs = self.scan()
+    now = time.time_ns()
+    rebuilt = []
+    for name, sig in sorted(inputs.items()):
+      old = self.state.get(name)
+      if old is not None and old['sig'] == sig \
+          and all(os.path.exists(f) for f in self.outputs(name)):
+        continue
+      if now - sig[0] < self.settle * 1e9:
+        continue   # probably still being written, next pass
+      try:
+        stats = self.build_one(name)
+      except (OSError, ValueError, IndexError) as e:
+        if self.verbose: print('Failed:', name, e)
+        continue
+      self.state[name] = { 'sig': sig, 'stats': stats }
+      rebuilt.append(name)
+      if self.verbose: print('Rebuilt:', name)
+    removed = [ name for name in self.state if name not in inputs ]
+    for name in removed:
+      del self.state[name]
+    if rebuilt or removed or not os.path.exists(os.path.join(self.datadir, STATS_FILE)):
+      self.write_stats()
+      self.save_state()
+    return rebuilt
+
+  def watch( self, interval=2.0 ):
+    while True:
+      self.build()
+      time.sleep(interval)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import atexit
+import time
+import queue
+import threading
+
+# File-like result writer for the acquisition loops.  write() only
+# queues the text, a background thread does the disk I/O, so a slow
+# disk never holds up the instrument loop.
+#
+# Durability is set by flush_every (points, counted by calls to flush())
+# and flush_secs (a timer); whichever comes first pushes the buffered
+# text to the OS.  checkpoint() and close() also fsync it to disk.
+# The queue is bounded, so if the disk falls far behind, write()
+# blocks rather than letting memory grow without limit.
+#
+# close() writes out everything queued before it.  Writers still open
+# when the program exits, say after an exception in the acquisition
+# loop, are closed by an atexit hook, so no queued point is lost.
+
+class Result_writer:
+  POINT = object()        # end of a data point
+  CHECKPOINT = object()   # flush and fsync
+  CLOSE = object()
+
+  def __init__( self, fname, flush_every=10, flush_secs=5.0, maxsize=1000 ):
+    self.fname = fname
+    self.flush_every = flush_every
+    self.flush_secs = flush_secs
+    self.queue = queue.Queue(maxsize)
+    self.fp = open(fname, 'w')
+    self.error = None
+    self.closed = False
+    self.thread = threading.Thread(target=self.worker, daemon=True)
+    self.thread.start()
+    atexit.register(self.close)
+
+  def write( self, text ):
+    if self.error is not None: raise self.error
+    self.queue.put(text)
+    return len(text)
+
+  def flush( self ):
+    # marks the end of a point, the actual flush is up to the policy
+    self.queue.put(Result_writer.POINT)
+
+  def checkpoint( self ):
+    self.queue.put(Result_writer.CHECKPOINT)
+
+  def close( self ):
+    # the worker drains the queue up to CLOSE before it stops
+    if not self.closed:
+      self.closed = True
+      atexit.unregister(self.close)
+      self.queue.put(Result_writer.CLOSE)
+      self.thread.join()
+    if self.error is not None: raise self.error
+
+  def __enter__( self ):
+    return self
+
+  def __exit__( self, *exc ):
+    self.close()
+
+  def sync( self ):
+    self.fp.flush()
+    os.fsync(self.fp.fileno())
+
+  def worker( self ):
+    npoints = 0
+    last = time.monotonic()
+    closed = False
+    try:
+      while True:
+        timeout = max(0.0, last + self.flush_secs - time.monotonic())
+        try:
+          item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+          item = None
+        if item is Result_writer.CLOSE:
+          closed = True
+          break
+        elif item is Result_writer.CHECKPOINT:
+          self.sync()
+          npoints = 0
+          last = time.monotonic()
+        elif item is Result_writer.POINT:
+          npoints += 1
+        elif item is not None:
+          self.fp.write(item)
+        if npoints >= self.flush_every \
+            or time.monotonic() - last >= self.flush_secs:
+          self.fp.flush()
+          npoints = 0
+          last = time.monotonic()
+      self.sync()
+    except OSError as e:
+      self.error = e
+      # keep draining so writers never block on a full queue
+      while not closed:
+        closed = self.queue.get() is Result_writer.CLOSE
+    finally:
+      self.fp.close()